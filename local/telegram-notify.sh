@@ -38,6 +38,8 @@ CLAUDE_NOTIFY_API_URL="${CLAUDE_NOTIFY_API_URL:-http://localhost:8000}"
 CLAUDE_NOTIFY_API_KEY="${CLAUDE_NOTIFY_API_KEY:-}"
 POLL_INTERVAL="${POLL_INTERVAL:-3}"
 POLL_TIMEOUT="${POLL_TIMEOUT:-3600}"
+# 与服务端 REPLY_TIMEOUT 保持一致
+REPLY_TIMEOUT="${REPLY_TIMEOUT:-25}"
 
 # 读取 stdin JSON 输入
 INPUT=$(cat)
@@ -143,7 +145,8 @@ send_notify() {
     local http_code=$(echo "$response" | tail -1)
     local body=$(echo "$response" | sed '$d')
 
-    if [ "$http_code" != "200" ]; then
+    # 服务端异步投递通知，返回 202 Accepted
+    if [ "$http_code" != "200" ] && [ "$http_code" != "202" ]; then
         echo "Error: Failed to send notification (HTTP $http_code)" >&2
         return 1
     fi
@@ -159,18 +162,28 @@ send_notify() {
 
 # 轮询等待回复
 poll_reply() {
-    local elapsed=0
+    # 服务端 /reply 会长轮询（最多挂起 REPLY_TIMEOUT 秒），按实际耗时计算超时
+    local start=$SECONDS
+    # 留出网络往返的余量
+    local max_time=$((${REPLY_TIMEOUT%.*} + 10))
 
-    while [ $elapsed -lt $POLL_TIMEOUT ]; do
+    while [ $((SECONDS - start)) -lt $POLL_TIMEOUT ]; do
         local response
-        response=$(curl -s -w "\n%{http_code}" -X GET \
+        response=$(curl -s --max-time "$max_time" -w "\n%{http_code}" -X GET \
             "${CLAUDE_NOTIFY_API_URL}/reply/${SESSION_ID}" \
-            -H "Authorization: Bearer ${CLAUDE_NOTIFY_API_KEY}" 2>/dev/null)
+            -H "Authorization: Bearer ${CLAUDE_NOTIFY_API_KEY}" 2>/dev/null) || true
 
         local http_code=$(echo "$response" | tail -1)
         local body=$(echo "$response" | sed '$d')
 
         if [ "$http_code" = "200" ]; then
+            # 通知未能投递到 Telegram，不会有回复，允许停止
+            local error=$(echo "$body" | jq -r '.error // empty')
+            if [ -n "$error" ]; then
+                echo "Error: Notification not delivered: $error" >&2
+                exit 0
+            fi
+
             local has_reply=$(echo "$body" | jq -r '.has_reply')
 
             if [ "$has_reply" = "true" ]; then
@@ -195,10 +208,11 @@ poll_reply() {
                         ;;
                 esac
             fi
+        else
+            # 请求失败（连接错误、超时等）时才等待再试；
+            # 正常的长轮询本身就会等待，无需额外 sleep
+            sleep $POLL_INTERVAL
         fi
-
-        sleep $POLL_INTERVAL
-        elapsed=$((elapsed + POLL_INTERVAL))
     done
 
     # 超时，允许停止
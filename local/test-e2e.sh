@@ -92,14 +92,15 @@ test_auth() {
     fi
 
     # 测试正确的 API Key
-    echo -n "   正确 API Key (应返回 200): "
+    echo -n "   正确 API Key (应返回 202): "
     http_code=$(curl -s -o /dev/null -w "%{http_code}" \
         -X POST "$CLAUDE_NOTIFY_API_URL/notify" \
         -H "Authorization: Bearer $CLAUDE_NOTIFY_API_KEY" \
         -H "Content-Type: application/json" \
         -d '{"session_id":"auth_test","status":"completed","summary":"认证测试","cwd":"/tmp"}')
 
-    if [ "$http_code" = "200" ]; then
+    # 服务端异步投递通知，返回 202 Accepted
+    if [ "$http_code" = "200" ] || [ "$http_code" = "202" ]; then
         echo "✅ PASS"
     else
         echo "❌ FAIL - HTTP $http_code"
@@ -130,18 +131,19 @@ test_telegram_notify() {
 
     ok=$(echo "$response" | jq -r '.ok' 2>/dev/null)
 
+    # 服务端只负责接收，通知在后台投递；投递失败不会体现在响应里
     if [ "$ok" = "true" ]; then
-        echo "✅ PASS"
+        echo "✅ PASS (已接收)"
         echo ""
         echo "   📱 请检查你的 Telegram 是否收到通知！"
         echo "   Session ID: $SESSION_ID"
-    else
-        echo "❌ FAIL - $response"
         echo ""
-        echo "   可能的原因:"
+        echo "   如果没有收到，请查看 VPS 上的服务端日志，可能的原因:"
         echo "   1. Telegram Bot Token 无效"
         echo "   2. Chat ID 不在白名单中"
         echo "   3. Bot 未被激活（需要先给 Bot 发送消息）"
+    else
+        echo "❌ FAIL - $response"
         return 1
     fi
 }
@@ -180,17 +182,26 @@ test_poll_reply() {
     echo "   等待回复中 (30秒超时)..."
     echo ""
 
-    # 轮询等待回复
-    for i in {1..10}; do
-        sleep 3
-        echo -n "   轮询 $i/10: "
-
-        response=$(curl -s "$CLAUDE_NOTIFY_API_URL/reply/$SESSION_ID" \
+    # 轮询等待回复；服务端会挂起每个请求直到有回复或超时，无需额外 sleep
+    local timeout=30
+    local start=$SECONDS
+    local i=0
+    while [ $((SECONDS - start)) -lt $timeout ]; do
+        i=$((i + 1))
+        local remaining=$((timeout - (SECONDS - start)))
+        echo -n "   轮询 $i (剩余 ${remaining}s): "
+
+        response=$(curl -s --max-time "$remaining" \
+            "$CLAUDE_NOTIFY_API_URL/reply/$SESSION_ID" \
             -H "Authorization: Bearer $CLAUDE_NOTIFY_API_KEY")
 
         has_reply=$(echo "$response" | jq -r '.has_reply' 2>/dev/null)
+        error=$(echo "$response" | jq -r '.error // empty' 2>/dev/null)
 
-        if [ "$has_reply" = "true" ]; then
+        if [ -n "$error" ]; then
+            echo "❌ 通知投递失败: $error"
+            return 1
+        elif [ "$has_reply" = "true" ]; then
             reply=$(echo "$response" | jq -r '.reply' 2>/dev/null)
             action=$(echo "$response" | jq -r '.action' 2>/dev/null)
             echo "✅ 收到回复!"
@@ -203,6 +214,10 @@ test_poll_reply() {
                 -H "Authorization: Bearer $CLAUDE_NOTIFY_API_KEY" > /dev/null
 
             return 0
+        elif [ -z "$response" ]; then
+            # 请求失败（连接错误等），稍等再试，避免空转
+            echo "请求失败"
+            sleep 1
         else
             echo "等待中..."
         fi
@@ -72,7 +72,7 @@ from claude_notify.api import create_app
 from claude_notify.store import SessionStore
 
 store = SessionStore()
-app = create_app(store=store, bot=None, api_key='test_api_key')
+app = create_app(store=store, bot=None, api_key='test_api_key', reply_timeout=1)
 
 if __name__ == '__main__':
     uvicorn.run(app, host='127.0.0.1', port=18000, log_level='warning')
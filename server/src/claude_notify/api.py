@@ -1,10 +1,17 @@
 """FastAPI routes for notification service."""
 
-from typing import Optional
-from fastapi import FastAPI, HTTPException, Depends, Header
+import asyncio
+import hmac
+import logging
+from functools import lru_cache
+from typing import Optional, Set
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from .models import (
+    HealthResponse,
     NotifyRequest,
     NotifyResponse,
     ReplyResponse,
@@ -12,20 +19,148 @@ from .models import (
 )
 from .store import SessionStore
 
+logger = logging.getLogger(__name__)
+
+# Routes that require a valid API key
+PROTECTED_PREFIXES = ("/notify", "/reply/", "/ack/")
+
+
+# Bodies of the fixed answers, serialized once; the hot /reply poll and
+# /health return these without running response serialization per request
+_HEALTH_OK = HealthResponse(status="ok").model_dump_json().encode()
+_NO_REPLY = ReplyResponse(has_reply=False).model_dump_json().encode()
+_ACK_OK = AckResponse(ok=True).model_dump_json().encode()
+
+
+def _json_response(body: bytes) -> Response:
+    """Wrap a pre-serialized JSON body."""
+    return Response(content=body, media_type="application/json")
+
+
+def _unauthorized(detail: str) -> JSONResponse:
+    """Build a 401 response matching HTTPException's body."""
+    return JSONResponse(status_code=401, content={"detail": detail})
+
+
+@lru_cache(maxsize=4)
+def check_authorization(authorization: Optional[bytes], api_key: Optional[str]) -> Optional[str]:
+    """Validate a raw Bearer Authorization header value.
+
+    Returns an error detail, or None if the header carries the API key.
+    Clients resend the same header on every poll, so results are cached;
+    the key is part of the cache key, so a new key never hits old entries.
+    """
+    if not authorization:
+        return "Missing authorization"
+    if authorization[:7].lower() != b"bearer ":
+        return "Invalid authorization format"
+    # Constant-time compare so response timing doesn't leak the key
+    if not api_key or not hmac.compare_digest(authorization[7:], api_key.encode()):
+        return "Invalid API key"
+    return None
+
+
+class APIKeyMiddleware:
+    """Require the API key on protected routes.
+
+    A plain ASGI middleware: it reads the header straight from the scope,
+    without building a Request or going through BaseHTTPMiddleware.
+    The key is read from ``app.state`` so lifespan can set it.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].startswith(PROTECTED_PREFIXES):
+            authorization = None
+            # ASGI servers lowercase header names
+            for name, value in scope["headers"]:
+                if name == b"authorization":
+                    authorization = value
+                    break
+            error = check_authorization(authorization, scope["app"].state.api_key)
+            if error:
+                await _unauthorized(error)(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
 
 def create_app(
     store: Optional[SessionStore] = None,
     bot=None,
     api_key: Optional[str] = None,
+    max_pending_deliveries: int = 64,
+    reply_timeout: float = 25.0,
+    lifespan=None,
 ) -> FastAPI:
-    """Create FastAPI application."""
+    """Create FastAPI application.
+
+    ``bot``, ``api_key`` and ``reply_timeout`` live on ``app.state`` so a
+    ``lifespan`` handler can fill them in once settings are loaded.
+    ``reply_timeout`` is how long ``/reply`` holds a request open waiting
+    for a reply before answering ``has_reply=False``.
+    """
 
     app = FastAPI(
         title="Claude Code Notify",
         description="Telegram notification service for Claude Code",
         version="0.1.0",
+        lifespan=lifespan,
     )
 
+    # Store dependencies
+    _store = store or SessionStore()
+    app.state.bot = bot
+    app.state.api_key = api_key
+    app.state.reply_timeout = reply_timeout
+
+    # Notifications are delivered in the background; the semaphore bounds
+    # how many can be in flight at once
+    _delivery_slots = asyncio.Semaphore(max_pending_deliveries)
+    _background_tasks: Set[asyncio.Task] = set()
+
+    async def _deliver(
+        bot,
+        payload: NotifyRequest,
+        existing_thread_id: Optional[int],
+    ):
+        """Send notification and record its thread info."""
+        try:
+            logger.info(f"Sending notification for session {payload.session_id}")
+            message_id, thread_id, chat_id = await bot.send_notification(
+                session_id=payload.session_id,
+                status=payload.status,
+                summary=payload.summary,
+                cwd=payload.cwd,
+                buttons=payload.buttons,
+                existing_thread_id=existing_thread_id,
+            )
+            _store.update_thread_id(payload.session_id, message_id, thread_id, chat_id)
+            logger.info(f"Notification sent: message_id={message_id}, thread_id={thread_id}, chat_id={chat_id}")
+        except Exception as e:
+            logger.error(f"Error sending notification: {e}")
+            _store.set_delivery_error(payload.session_id, str(e) or type(e).__name__)
+        finally:
+            _delivery_slots.release()
+
+    async def _send_ack(bot, chat_id: int, thread_id: Optional[int]):
+        """Send the ack message, logging rather than raising on failure."""
+        try:
+            await bot.send_ack(chat_id, thread_id)
+        except Exception as e:
+            logger.error(f"Error sending ack: {e}")
+
+    def _spawn(coro) -> None:
+        """Run coro in the background, keeping a reference until it ends."""
+        task = asyncio.create_task(coro)
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    app.add_middleware(APIKeyMiddleware)
+
+    # Added after the auth middleware so CORS runs first and can answer
+    # preflight requests, which carry no Authorization header
     app.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],
@@ -34,88 +169,81 @@ def create_app(
         allow_headers=["*"],
     )
 
-    # Store dependencies
-    _store = store or SessionStore()
-    _bot = bot
-    _api_key = api_key
-
-    def verify_api_key(authorization: Optional[str] = Header(None)):
-        """Verify API key from Authorization header."""
-        if not authorization:
-            raise HTTPException(status_code=401, detail="Missing authorization")
-
-        parts = authorization.split(" ")
-        if len(parts) != 2 or parts[0].lower() != "bearer":
-            raise HTTPException(status_code=401, detail="Invalid authorization format")
-
-        if parts[1] != _api_key:
-            raise HTTPException(status_code=401, detail="Invalid API key")
-
-        return parts[1]
-
-    @app.get("/health")
+    @app.get("/health", response_model=HealthResponse)
     async def health():
         """Health check endpoint."""
-        return {"status": "ok"}
+        return _json_response(_HEALTH_OK)
 
-    @app.post("/notify", response_model=NotifyResponse)
+    @app.post("/notify", response_model=NotifyResponse, status_code=202)
     async def notify(
-        request: NotifyRequest,
-        _: str = Depends(verify_api_key),
+        request: Request,
+        payload: NotifyRequest,
     ):
-        """Send notification to Telegram."""
+        """Queue notification for delivery to Telegram."""
         try:
-            # Create or get session
+            # Create or get session; notifications always go to the bot's
+            # primary chat, so record it up front instead of 0
+            bot = request.app.state.bot
             session = _store.create_session(
-                session_id=request.session_id,
-                chat_id=0,  # Will be set by bot
-                cwd=request.cwd,
+                session_id=payload.session_id,
+                chat_id=bot.primary_chat_id if bot else 0,
+                cwd=payload.cwd,
             )
 
-            # Send via bot
-            if _bot:
-                message_id, thread_id = await _bot.send_notification(
-                    session_id=request.session_id,
-                    status=request.status,
-                    summary=request.summary,
-                    cwd=request.cwd,
-                    buttons=request.buttons,
-                    existing_thread_id=session.thread_id,
-                )
-                _store.update_thread_id(request.session_id, message_id, thread_id)
-                return NotifyResponse(
-                    ok=True,
-                    message_id=message_id,
-                    thread_id=thread_id,
-                )
+            # Send via bot in the background
+            if bot:
+                await _delivery_slots.acquire()
+                _spawn(_deliver(bot, payload, session.thread_id))
+            else:
+                logger.warning("Bot not initialized, notification not sent")
 
-            return NotifyResponse(ok=True)
+            return NotifyResponse(ok=True, thread_id=session.thread_id)
 
         except Exception as e:
-            return NotifyResponse(ok=False, error=str(e))
+            logger.error(f"Error queueing notification: {e}")
+            return JSONResponse(
+                status_code=500,
+                content=NotifyResponse(ok=False, error=str(e)).model_dump(),
+            )
 
     @app.get("/reply/{session_id}", response_model=ReplyResponse)
     async def get_reply(
+        request: Request,
         session_id: str,
-        _: str = Depends(verify_api_key),
     ):
-        """Get pending reply for session."""
+        """Get pending reply for session, long-polling until one arrives."""
         session = _store.get_session(session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
 
+        reply_timeout = request.app.state.reply_timeout
+        if (
+            session.pending_reply is None
+            and session.delivery_error is None
+            and reply_timeout > 0
+        ):
+            try:
+                await asyncio.wait_for(
+                    session.reply_event.wait(), timeout=reply_timeout
+                )
+            except asyncio.TimeoutError:
+                pass
+
         if session.pending_reply:
             return ReplyResponse(
                 has_reply=True,
                 reply=session.pending_reply,
                 action=session.action,
             )
-        return ReplyResponse(has_reply=False)
+        if session.delivery_error:
+            # No reply can come for a notification that was never sent
+            return ReplyResponse(has_reply=False, error=session.delivery_error)
+        return _json_response(_NO_REPLY)
 
     @app.post("/ack/{session_id}", response_model=AckResponse)
     async def ack_reply(
+        request: Request,
         session_id: str,
-        _: str = Depends(verify_api_key),
     ):
         """Acknowledge receipt of reply."""
         session = _store.get_session(session_id)
@@ -124,9 +252,11 @@ def create_app(
 
         _store.clear_reply(session_id)
 
-        if _bot:
-            await _bot.send_ack(session.chat_id, session.thread_id)
+        # The client doesn't wait for the Telegram round-trip
+        bot = request.app.state.bot
+        if bot:
+            _spawn(_send_ack(bot, session.chat_id, session.thread_id))
 
-        return AckResponse(ok=True)
+        return _json_response(_ACK_OK)
 
     return app
@@ -1,10 +1,21 @@
 """Telegram Bot for Claude Code notifications."""
 
+import asyncio
 import logging
-from datetime import datetime
-from typing import List, Optional, Tuple
-
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from telegram import (
+    CallbackQuery,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    Message,
+    Update,
+)
+from telegram.error import RetryAfter
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -14,11 +25,27 @@ from telegram.ext import (
     filters,
 )
 
-from .models import ActionType, StatusType
+from .models import ActionType, SessionData, StatusType
 from .store import SessionStore
 
 logger = logging.getLogger(__name__)
 
+_DONE_TOKENS = frozenset({"/done", "done", "结束"})
+_CANCEL_TOKENS = frozenset({"/cancel", "cancel", "取消", "no", "拒绝"})
+# Longer input can never be a command token, so skip lowercasing it
+_MAX_TOKEN_LEN = max(len(token) for token in _DONE_TOKENS | _CANCEL_TOKENS)
+
+# Plain text replies; built once rather than on every setup_handlers call
+_TEXT_NOT_COMMAND = filters.TEXT & ~filters.COMMAND
+
+
+@dataclass
+class SendJob:
+    """Outbound Telegram message waiting in the send queue."""
+    chat_id: int
+    kwargs: Dict[str, Any]
+    future: "asyncio.Future[Message]"
+
 
 class TelegramNotifyBot:
     """Telegram bot for handling Claude Code notifications."""
@@ -29,6 +56,13 @@ class TelegramNotifyBot:
         StatusType.IDLE: "⏳ 等待输入",
     }
 
+    # Telegram flood limits: 30 msg/s overall, 20 msg/min per chat
+    GLOBAL_RATE_LIMIT = 30
+    CHAT_RATE_LIMIT = 20
+    CHAT_RATE_WINDOW = 60.0
+
+    KEYBOARD_CACHE_SIZE = 128
+
     def __init__(
         self,
         token: str,
@@ -36,10 +70,37 @@ class TelegramNotifyBot:
         store: SessionStore,
     ):
         self.token = token
-        self.allowed_chat_ids = allowed_chat_ids
+        # Notifications go to the first configured chat; membership checks
+        # run on every update, so keep the allow-list as a set
+        self.primary_chat_id = allowed_chat_ids[0]
+        self.allowed_chat_ids = frozenset(allowed_chat_ids)
         self.store = store
         self.app: Optional[Application] = None
 
+        # Keyboards are immutable, so build them once and reuse
+        self._default_keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton("继续", callback_data="action:continue"),
+            InlineKeyboardButton("结束", callback_data="action:done"),
+        ]])
+        self._keyboard_cache: Dict[Tuple[str, ...], InlineKeyboardMarkup] = {}
+
+        # Callback data -> handler; other "btn:" data is a custom button
+        self._callback_handlers = {
+            "action:done": self._on_done,
+            "btn:结束": self._on_done,
+            "action:continue": self._on_continue,
+            "btn:继续": self._on_continue,
+            "action:detail": self._on_detail,
+            "btn:查看详情": self._on_detail,
+        }
+
+        # Outbound queue, drained by a single sender task
+        self._out_queue: asyncio.Queue[SendJob] = asyncio.Queue()
+        self._sender_task: Optional[asyncio.Task] = None
+        self._tokens_global: float = self.GLOBAL_RATE_LIMIT
+        self._tokens_refilled_at = time.monotonic()
+        self._tokens_per_chat: Dict[int, Deque[float]] = {}
+
     def is_allowed_chat(self, chat_id: int) -> bool:
         """Check if chat is in allowed list."""
         return chat_id in self.allowed_chat_ids
@@ -52,45 +113,65 @@ class TelegramNotifyBot:
         cwd: str,
     ) -> str:
         """Format notification message."""
-        short_id = session_id[:4]
-        status_text = self.STATUS_EMOJI.get(status, "📋 通知")
+        # 标题和目录行对同一 session 不变，缓存在 session 上
+        session = self.store.get_session(session_id)
+        key = (status, cwd)
+        prefix = session.prefix_cache.get(key) if session else None
+
+        if prefix is None:
+            short_id = session_id[:4]
+            status_text = self.STATUS_EMOJI.get(status, "📋 通知")
 
-        # 简化目录显示：只显示最后两级
-        cwd_parts = cwd.rstrip('/').split('/')
-        short_cwd = '/'.join(cwd_parts[-2:]) if len(cwd_parts) > 2 else cwd
+            # 简化目录显示：只显示最后两级
+            cwd_parts = cwd.rstrip('/').split('/')
+            short_cwd = '/'.join(cwd_parts[-2:]) if len(cwd_parts) > 2 else cwd
 
-        return f"""{status_text} #{short_id}
-📁 {short_cwd}
+            prefix = f"{status_text} #{short_id}\n📁 {short_cwd}\n\n"
+            if session:
+                session.prefix_cache[key] = prefix
 
-{summary}"""
+        return prefix + summary
 
     def get_keyboard(
         self,
         buttons: Optional[List[str]] = None,
     ) -> InlineKeyboardMarkup:
         """Create inline keyboard."""
-        if buttons:
+        if not buttons:
+            return self._default_keyboard
+
+        key = tuple(buttons)
+        keyboard = self._keyboard_cache.get(key)
+        if keyboard is None:
+            if len(self._keyboard_cache) >= self.KEYBOARD_CACHE_SIZE:
+                # Drop the oldest entry
+                self._keyboard_cache.pop(next(iter(self._keyboard_cache)))
             # 所有按钮放在一行
-            keyboard = [[
+            keyboard = InlineKeyboardMarkup([[
                 InlineKeyboardButton(btn, callback_data=f"btn:{btn}")
                 for btn in buttons
-            ]]
-        else:
-            keyboard = [[
-                InlineKeyboardButton("继续", callback_data="action:continue"),
-                InlineKeyboardButton("结束", callback_data="action:done"),
-            ]]
-        return InlineKeyboardMarkup(keyboard)
+            ]])
+            self._keyboard_cache[key] = keyboard
+        return keyboard
 
     def parse_user_input(self, text: str) -> Tuple[ActionType, str]:
         """Parse user input to determine action."""
         text = text.strip()
-        if text.lower() in ["/done", "done", "结束"]:
+        if len(text) > _MAX_TOKEN_LEN:
+            return ActionType.CONTINUE, text
+
+        # Try the raw text first; only lowercase it on a miss
+        if text in _DONE_TOKENS:
             return ActionType.DONE, text
-        elif text.lower() in ["/cancel", "cancel", "取消", "no", "拒绝"]:
+        if text in _CANCEL_TOKENS:
             return ActionType.CANCEL, text
-        else:
-            return ActionType.CONTINUE, text
+
+        lowered = text.lower()
+        if lowered in _DONE_TOKENS:
+            return ActionType.DONE, text
+        if lowered in _CANCEL_TOKENS:
+            return ActionType.CANCEL, text
+        return ActionType.CONTINUE, text
 
     async def send_notification(
         self,
@@ -105,14 +186,14 @@ class TelegramNotifyBot:
         if not self.app:
             raise RuntimeError("Bot not initialized")
 
-        chat_id = self.allowed_chat_ids[0]  # Primary chat
+        chat_id = self.primary_chat_id
         message_text = self.format_message(session_id, status, summary, cwd)
         keyboard = self.get_keyboard(buttons)
 
         if existing_thread_id:
             # Reply in existing thread
-            msg = await self.app.bot.send_message(
-                chat_id=chat_id,
+            msg = await self._send_message(
+                chat_id,
                 text=message_text,
                 reply_markup=keyboard,
                 reply_to_message_id=existing_thread_id,
@@ -120,8 +201,8 @@ class TelegramNotifyBot:
             return msg.message_id, existing_thread_id, chat_id
         else:
             # Create new message (thread root)
-            msg = await self.app.bot.send_message(
-                chat_id=chat_id,
+            msg = await self._send_message(
+                chat_id,
                 text=message_text,
                 reply_markup=keyboard,
             )
@@ -136,12 +217,93 @@ class TelegramNotifyBot:
         if not self.app:
             return
 
-        await self.app.bot.send_message(
-            chat_id=chat_id,
+        await self._send_message(
+            chat_id,
             text="✅ 已收到回复，正在执行...",
             reply_to_message_id=thread_id,
         )
 
+    async def _send_message(self, chat_id: int, **kwargs: Any) -> Message:
+        """Queue a message for sending and wait until it is delivered."""
+        if not self._sender_task:
+            raise RuntimeError("Bot not initialized")
+
+        future = asyncio.get_running_loop().create_future()
+        await self._out_queue.put(SendJob(chat_id, kwargs, future))
+        return await future
+
+    async def _wait_for_rate_limit(self, chat_id: int) -> None:
+        """Sleep until both the global and per-chat buckets allow a send."""
+        window = self._tokens_per_chat.setdefault(chat_id, deque())
+        while True:
+            now = time.monotonic()
+            elapsed = now - self._tokens_refilled_at
+            self._tokens_global = min(
+                self.GLOBAL_RATE_LIMIT,
+                self._tokens_global + elapsed * self.GLOBAL_RATE_LIMIT,
+            )
+            self._tokens_refilled_at = now
+            while window and now - window[0] >= self.CHAT_RATE_WINDOW:
+                window.popleft()
+
+            delay = 0.0
+            if self._tokens_global < 1:
+                delay = (1 - self._tokens_global) / self.GLOBAL_RATE_LIMIT
+            if len(window) >= self.CHAT_RATE_LIMIT:
+                delay = max(delay, window[0] + self.CHAT_RATE_WINDOW - now)
+            if delay <= 0:
+                self._tokens_global -= 1
+                window.append(now)
+                return
+            await asyncio.sleep(delay)
+
+    async def _sender_loop(self) -> None:
+        """Drain the outbound queue, respecting Telegram flood limits."""
+        while True:
+            job = await self._out_queue.get()
+            try:
+                while not job.future.done():
+                    await self._wait_for_rate_limit(job.chat_id)
+                    try:
+                        msg = await self.app.bot.send_message(
+                            chat_id=job.chat_id, **job.kwargs
+                        )
+                    except RetryAfter as e:
+                        retry_after = e.retry_after
+                        if isinstance(retry_after, timedelta):
+                            retry_after = retry_after.total_seconds()
+                        logger.warning(
+                            f"Flood control for chat {job.chat_id}, retrying in {retry_after}s"
+                        )
+                        await asyncio.sleep(retry_after)
+                    except Exception as e:
+                        if not job.future.done():
+                            job.future.set_exception(e)
+                    else:
+                        if not job.future.done():
+                            job.future.set_result(msg)
+            finally:
+                # Only left pending if the sender itself was cancelled
+                if not job.future.done():
+                    job.future.cancel()
+                self._out_queue.task_done()
+
+    async def _safe_delete(self, chat_id: int, message_id: int) -> bool:
+        """Delete a message, logging instead of raising on failure."""
+        try:
+            await self.app.bot.delete_message(chat_id=chat_id, message_id=message_id)
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to delete message {message_id}: {e}")
+            return False
+
+    async def _delete_messages(self, chat_id: int, message_ids: List[int]) -> int:
+        """Delete messages concurrently. Returns count of deleted messages."""
+        results = await asyncio.gather(
+            *(self._safe_delete(chat_id, msg_id) for msg_id in message_ids)
+        )
+        return sum(results)
+
     async def handle_message(
         self,
         update: Update,
@@ -180,9 +342,10 @@ class TelegramNotifyBot:
         if session.chat_id == 0:
             self.store.update_chat_id(session.session_id, chat_id)
 
-        # 追踪用户回复消息 ID
+        # 追踪用户回复消息 ID，和确认消息一起写入
+        related_ids = []
         if update.message.message_id:
-            self.store.add_related_message(session.session_id, update.message.message_id)
+            related_ids.append(update.message.message_id)
 
         # Parse and store reply
         text = update.message.text or ""
@@ -191,16 +354,14 @@ class TelegramNotifyBot:
 
         # Send confirmation and track the confirmation message
         if action == ActionType.DONE:
-            msg = await update.message.reply_text("✅ 任务已结束")
-            self.store.add_related_message(session.session_id, msg.message_id)
+            confirmation = "✅ 任务已结束"
         elif action == ActionType.CANCEL:
-            msg = await update.message.reply_text("❌ 任务已取消")
-            self.store.add_related_message(session.session_id, msg.message_id)
+            confirmation = "❌ 任务已取消"
         else:
-            msg = await update.message.reply_text(
-                f"📨 已发送到 Claude (#{session.short_id})"
-            )
-            self.store.add_related_message(session.session_id, msg.message_id)
+            confirmation = f"📨 已发送到 Claude (#{session.short_id})"
+        msg = await update.message.reply_text(confirmation)
+        related_ids.append(msg.message_id)
+        self.store.add_related_messages(session.session_id, related_ids)
 
     async def handle_callback(
         self,
@@ -249,78 +410,72 @@ class TelegramNotifyBot:
             self.store.update_chat_id(session.session_id, chat_id)
 
         # Handle different callback types
-        if data == "action:done" or data == "btn:结束":
-            self.store.set_reply(session.session_id, "/done", ActionType.DONE)
-            logger.info(f"Session {session.session_id}: action=done")
+        handler = self._callback_handlers.get(data)
+        if handler:
+            await handler(session, query, chat_id)
+        elif data.startswith("btn:"):
+            await self._on_custom_button(session, query, chat_id, data[4:])
 
-            # 删除所有相关消息（原始通知、用户回复、确认消息等）
-            deleted_count = 0
-            # 先删除原始通知消息
-            try:
-                await query.message.delete()
-                deleted_count += 1
-            except Exception as e:
-                logger.warning(f"Failed to delete notification message: {e}")
-
-            # 删除所有追踪的相关消息
-            related_ids = self.store.get_related_messages(session.session_id)
-            for msg_id in related_ids:
-                try:
-                    await self.app.bot.delete_message(chat_id=chat_id, message_id=msg_id)
-                    deleted_count += 1
-                except Exception as e:
-                    logger.warning(f"Failed to delete message {msg_id}: {e}")
-
-            logger.info(f"Session {session.session_id}: deleted {deleted_count} messages")
-
-            # Delete session from store
-            self.store.delete_session(session.session_id)
-            logger.info(f"Session {session.session_id}: session deleted")
-
-        elif data == "action:continue" or data == "btn:继续":
-            logger.info(f"Session {session.session_id}: waiting for input")
-            msg = await query.message.reply_text(
-                "💬 请输入要继续执行的指令："
-            )
-            # 追踪这条提示消息
-            self.store.add_related_message(session.session_id, msg.message_id)
-
-        elif data == "action:detail" or data == "btn:查看详情":
-            msg = await query.message.reply_text(
-                f"📋 Session: {session.session_id}\n"
-                f"📁 目录: {session.cwd}\n"
-                f"⏱️ 创建: {session.created_at}"
-            )
-            self.store.add_related_message(session.session_id, msg.message_id)
+    async def _finish_session(
+        self,
+        session: SessionData,
+        chat_id: int,
+        message_id: int,
+    ) -> None:
+        """Delete the notification, all related messages and the session."""
+        # 删除所有相关消息（原始通知、用户回复、确认消息等）
+        related_ids = self.store.get_related_messages(session.session_id)
+        deleted_count = await self._delete_messages(
+            chat_id, [message_id, *related_ids]
+        )
+        logger.info(f"Session {session.session_id}: deleted {deleted_count} messages")
+
+        # Delete session from store
+        self.store.delete_session(session.session_id)
+        logger.info(f"Session {session.session_id}: session deleted")
+
+    async def _on_done(self, session: SessionData, query: CallbackQuery, chat_id: int) -> None:
+        """Handle the done button."""
+        self.store.set_reply(session.session_id, "/done", ActionType.DONE)
+        logger.info(f"Session {session.session_id}: action=done")
+        await self._finish_session(session, chat_id, query.message.message_id)
+
+    async def _on_continue(self, session: SessionData, query: CallbackQuery, chat_id: int) -> None:
+        """Handle the continue button by prompting for input."""
+        logger.info(f"Session {session.session_id}: waiting for input")
+        msg = await query.message.reply_text(
+            "💬 请输入要继续执行的指令："
+        )
+        # 追踪这条提示消息
+        self.store.add_related_message(session.session_id, msg.message_id)
+
+    async def _on_detail(self, session: SessionData, query: CallbackQuery, chat_id: int) -> None:
+        """Handle the detail button."""
+        msg = await query.message.reply_text(
+            f"📋 Session: {session.session_id}\n"
+            f"📁 目录: {session.cwd}\n"
+            f"⏱️ 创建: {datetime.fromtimestamp(session.created_at)}"
+        )
+        self.store.add_related_message(session.session_id, msg.message_id)
 
-        elif data.startswith("btn:"):
-            # Handle custom button - treat as continue with button text
-            btn_text = data[4:]  # Remove "btn:" prefix
-            action, reply = self.parse_user_input(btn_text)
-            self.store.set_reply(session.session_id, reply, action)
-            logger.info(f"Session {session.session_id}: custom button '{btn_text}', action={action}")
-
-            if action == ActionType.DONE:
-                # 删除所有相关消息
-                deleted_count = 0
-                try:
-                    await query.message.delete()
-                    deleted_count += 1
-                except Exception:
-                    pass
-                related_ids = self.store.get_related_messages(session.session_id)
-                for msg_id in related_ids:
-                    try:
-                        await self.app.bot.delete_message(chat_id=chat_id, message_id=msg_id)
-                        deleted_count += 1
-                    except Exception:
-                        pass
-                logger.info(f"Session {session.session_id}: deleted {deleted_count} messages")
-                self.store.delete_session(session.session_id)
-            else:
-                await query.edit_message_text(
-                    query.message.text + f"\n\n📨 已发送: {btn_text}"
-                )
+    async def _on_custom_button(
+        self,
+        session: SessionData,
+        query: CallbackQuery,
+        chat_id: int,
+        btn_text: str,
+    ) -> None:
+        """Handle custom button - treat as continue with button text."""
+        action, reply = self.parse_user_input(btn_text)
+        self.store.set_reply(session.session_id, reply, action)
+        logger.info(f"Session {session.session_id}: custom button '{btn_text}', action={action}")
+
+        if action == ActionType.DONE:
+            await self._finish_session(session, chat_id, query.message.message_id)
+        else:
+            await query.edit_message_text(
+                query.message.text + f"\n\n📨 已发送: {btn_text}"
+            )
 
     async def handle_status(
         self,
@@ -340,22 +495,16 @@ class TelegramNotifyBot:
             await update.message.reply_text("✅ 没有等待中的任务")
             return
 
-        lines = ["📋 等待中的任务:\n"]
-        for s in waiting:
-            lines.append(f"• #{s.short_id} - {s.cwd}")
-
-        await update.message.reply_text("\n".join(lines))
+        await update.message.reply_text(
+            "📋 等待中的任务:\n\n"
+            + "\n".join(f"• #{s.short_id} - {s.cwd}" for s in waiting)
+        )
 
     def setup_handlers(self, app: Application) -> None:
         """Setup message handlers."""
         app.add_handler(CommandHandler("status", self.handle_status))
         app.add_handler(CallbackQueryHandler(self.handle_callback))
-        app.add_handler(
-            MessageHandler(
-                filters.TEXT & ~filters.COMMAND,
-                self.handle_message,
-            )
-        )
+        app.add_handler(MessageHandler(_TEXT_NOT_COMMAND, self.handle_message))
 
     async def start(self) -> None:
         """Start the bot."""
@@ -364,9 +513,23 @@ class TelegramNotifyBot:
         await self.app.initialize()
         await self.app.start()
         await self.app.updater.start_polling()
+        self._sender_task = asyncio.create_task(self._sender_loop())
 
     async def stop(self) -> None:
         """Stop the bot."""
+        if self._sender_task:
+            self._sender_task.cancel()
+            try:
+                await self._sender_task
+            except asyncio.CancelledError:
+                pass
+            self._sender_task = None
+            # Fail anything still queued so callers don't wait forever
+            while not self._out_queue.empty():
+                job = self._out_queue.get_nowait()
+                job.future.cancel()
+                self._out_queue.task_done()
+
         if self.app:
             await self.app.updater.stop()
             await self.app.stop()
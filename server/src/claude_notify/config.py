@@ -3,7 +3,7 @@
 from functools import lru_cache
 from typing import List, Union
 
-from pydantic import model_validator
+from pydantic import Field, model_validator
 from pydantic_settings import BaseSettings
 
 
@@ -23,6 +23,9 @@ class Settings(BaseSettings):
 
     # Session
     session_expiry: int = 86400  # 24 hours
+    max_sessions: int = Field(10000, ge=1)  # oldest sessions are evicted beyond this
+    cleanup_interval: int = 60  # seconds between expiry sweeps
+    reply_timeout: float = 25.0  # seconds /reply long-polls before returning
 
     model_config = {
         "env_file": ".env",
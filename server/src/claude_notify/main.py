@@ -3,20 +3,14 @@
 import asyncio
 import logging
 from contextlib import asynccontextmanager
-from typing import Optional
 
 import uvicorn
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI
 
+from .api import create_app
 from .bot import TelegramNotifyBot
 from .config import get_settings
 from .store import SessionStore
-from .models import (
-    NotifyRequest,
-    NotifyResponse,
-    ReplyResponse,
-    AckResponse,
-)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -25,18 +19,17 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-# Global instances
+# Global instances; the bot lives on app.state once started
 store = SessionStore()
-bot: Optional[TelegramNotifyBot] = None
-_api_key: Optional[str] = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage application lifecycle."""
-    global bot, _api_key
     settings = get_settings()
-    _api_key = settings.api_key
+    app.state.api_key = settings.api_key
+    app.state.reply_timeout = settings.reply_timeout
+    store.max_sessions = settings.max_sessions
 
     # Start Telegram bot
     bot = TelegramNotifyBot(
@@ -45,10 +38,15 @@ async def lifespan(app: FastAPI):
         store=store,
     )
     await bot.start()
-    logger.info("Telegram bot started")
+    app.state.bot = bot
+    logger.info(
+        f"Telegram bot started on {type(asyncio.get_running_loop()).__name__}"
+    )
 
     # Start cleanup task
-    cleanup_task = asyncio.create_task(cleanup_loop(settings.session_expiry))
+    cleanup_task = asyncio.create_task(
+        cleanup_loop(settings.session_expiry, settings.cleanup_interval)
+    )
 
     yield
 
@@ -59,134 +57,37 @@ async def lifespan(app: FastAPI):
     except asyncio.CancelledError:
         pass
     await bot.stop()
+    app.state.bot = None
     logger.info("Telegram bot stopped")
 
 
-async def cleanup_loop(expiry_seconds: int):
-    """Periodically cleanup expired sessions."""
+async def cleanup_loop(expiry_seconds: int, interval_seconds: int = 60):
+    """Cleanup expired sessions when the store fills up, or periodically."""
     while True:
-        await asyncio.sleep(3600)  # Every hour
+        try:
+            await asyncio.wait_for(
+                store.cleanup_needed.wait(), timeout=interval_seconds
+            )
+        except asyncio.TimeoutError:
+            pass
+        store.cleanup_needed.clear()
         removed = store.cleanup_expired(expiry_seconds)
         if removed:
             logger.info(f"Cleaned up {removed} expired sessions")
 
 
-# Create app with lifespan
-app = FastAPI(
-    title="Claude Code Notify",
-    description="Telegram notification service for Claude Code",
-    version="0.1.0",
-    lifespan=lifespan,
-)
-
-
-def verify_api_key(authorization: Optional[str] = Header(None)):
-    """Verify API key from Authorization header."""
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Missing authorization")
-
-    parts = authorization.split(" ")
-    if len(parts) != 2 or parts[0].lower() != "bearer":
-        raise HTTPException(status_code=401, detail="Invalid authorization format")
-
-    if parts[1] != _api_key:
-        raise HTTPException(status_code=401, detail="Invalid API key")
-
-    return parts[1]
-
-
-@app.get("/health")
-async def health():
-    """Health check endpoint."""
-    return {"status": "ok"}
-
-
-@app.post("/notify", response_model=NotifyResponse)
-async def notify(
-    request: NotifyRequest,
-    _: str = Depends(verify_api_key),
-):
-    """Send notification to Telegram."""
-    global bot
-    try:
-        # Create or get session
-        session = store.create_session(
-            session_id=request.session_id,
-            chat_id=0,  # Will be set by bot
-            cwd=request.cwd,
-        )
-
-        # Send via bot
-        if bot:
-            logger.info(f"Sending notification for session {request.session_id}")
-            message_id, thread_id, chat_id = await bot.send_notification(
-                session_id=request.session_id,
-                status=request.status,
-                summary=request.summary,
-                cwd=request.cwd,
-                buttons=request.buttons,
-                existing_thread_id=session.thread_id,
-            )
-            store.update_thread_id(request.session_id, message_id, thread_id, chat_id)
-            logger.info(f"Notification sent: message_id={message_id}, thread_id={thread_id}, chat_id={chat_id}")
-            return NotifyResponse(
-                ok=True,
-                message_id=message_id,
-                thread_id=thread_id,
-            )
-        else:
-            logger.warning("Bot not initialized, notification not sent")
-
-        return NotifyResponse(ok=True)
-
-    except Exception as e:
-        logger.error(f"Error sending notification: {e}")
-        return NotifyResponse(ok=False, error=str(e))
-
-
-@app.get("/reply/{session_id}", response_model=ReplyResponse)
-async def get_reply(
-    session_id: str,
-    _: str = Depends(verify_api_key),
-):
-    """Get pending reply for session."""
-    session = store.get_session(session_id)
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-
-    if session.pending_reply:
-        return ReplyResponse(
-            has_reply=True,
-            reply=session.pending_reply,
-            action=session.action,
-        )
-    return ReplyResponse(has_reply=False)
-
-
-@app.post("/ack/{session_id}", response_model=AckResponse)
-async def ack_reply(
-    session_id: str,
-    _: str = Depends(verify_api_key),
-):
-    """Acknowledge receipt of reply."""
-    global bot
-    session = store.get_session(session_id)
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-
-    store.clear_reply(session_id)
-
-    if bot:
-        await bot.send_ack(session.chat_id, session.thread_id)
-
-    return AckResponse(ok=True)
+# Create app with lifespan; bot and API key are filled in at startup
+app = create_app(store=store, lifespan=lifespan)
 
 
 def main():
     """Run the server."""
     settings = get_settings()
+    # Pass the app object rather than "claude_notify.main:app": under
+    # `python -m claude_notify.main` the import string would load this
+    # module a second time and build a second app and store
     uvicorn.run(
-        "claude_notify.main:app",
+        app,
         host=settings.host,
         port=settings.port,
         reload=False,
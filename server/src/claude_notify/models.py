@@ -1,8 +1,11 @@
 """Data models for Claude Code notification service."""
 
-from datetime import datetime
+import array
+import asyncio
+import time
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
 from pydantic import BaseModel, Field
 
@@ -21,6 +24,11 @@ class ActionType(str, Enum):
     CANCEL = "cancel"
 
 
+class HealthResponse(BaseModel):
+    """Health check response."""
+    status: str
+
+
 class NotifyRequest(BaseModel):
     """Request to send a notification."""
     session_id: str = Field(..., description="Claude Code session ID")
@@ -46,6 +54,8 @@ class ReplyResponse(BaseModel):
     has_reply: bool
     reply: Optional[str] = None
     action: Optional[ActionType] = None
+    # Set when the notification could not be delivered to Telegram
+    error: Optional[str] = None
 
 
 class AckResponse(BaseModel):
@@ -54,8 +64,13 @@ class AckResponse(BaseModel):
     error: Optional[str] = None
 
 
-class SessionData(BaseModel):
-    """Internal session data storage."""
+@dataclass(slots=True, kw_only=True)
+class SessionData:
+    """Internal session data storage.
+
+    Never sent over the wire, so a plain slotted dataclass rather than a
+    pydantic model: no validation on construction or attribute writes.
+    """
     session_id: str
     chat_id: int
     message_id: Optional[int] = None
@@ -63,10 +78,23 @@ class SessionData(BaseModel):
     cwd: str
     pending_reply: Optional[str] = None
     action: Optional[ActionType] = None
-    created_at: datetime = Field(default_factory=datetime.now)
-    updated_at: datetime = Field(default_factory=datetime.now)
-    # 追踪所有相关消息 ID，用于批量删除
-    related_message_ids: list[int] = Field(default_factory=list)
+    # 后台投递通知失败时的错误，/reply 据此告知客户端不必再等待
+    delivery_error: Optional[str] = None
+    # 在 store 中的创建序号；时间戳可能相同，等待队列按它排序
+    seq: int = 0
+    # Unix timestamps (time.time()), cheaper to create and compare than datetime
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    # 追踪所有相关消息 ID，用于批量删除；以 64 位整数紧凑存储
+    related_message_ids: array.array = field(default_factory=lambda: array.array("q"))
+    # 缓存 bot 格式化后的消息头，key 为 (status, cwd)
+    prefix_cache: Dict[Tuple[StatusType, str], str] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    # 有待处理回复时置位，供 /reply 长轮询等待
+    reply_event: asyncio.Event = field(
+        default_factory=asyncio.Event, init=False, repr=False, compare=False
+    )
 
     @property
     def short_id(self) -> str:
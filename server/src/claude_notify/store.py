@@ -1,19 +1,78 @@
 """Session storage management."""
 
-from datetime import datetime, timedelta
-from threading import Lock
-from typing import Dict, List, Optional
+import asyncio
+import time
+from collections import OrderedDict
+from itertools import count, islice
+from typing import Callable, Dict, Iterable, List, Optional
 
 from .models import SessionData, ActionType
 
 
 class SessionStore:
-    """Thread-safe in-memory session storage."""
+    """In-memory session storage.
 
-    def __init__(self):
-        self._sessions: Dict[str, SessionData] = {}
+    The store is only used from the event loop, and no method awaits, so
+    each call runs to completion without interleaving and needs no lock.
+    """
+
+    # Fraction of max_sessions at which cleanup_needed is set
+    CLEANUP_HIGH_WATER = 0.9
+
+    def __init__(
+        self,
+        max_sessions: int = 10000,
+        now: Callable[[], float] = time.time,
+    ):
+        # Clock for session timestamps; injectable so tests can move time
+        self._now = now
+        # Kept in creation order: the oldest session is always first, which
+        # makes both capacity eviction and the expiry sweep O(removed)
+        self._sessions: "OrderedDict[str, SessionData]" = OrderedDict()
+        self.max_sessions = max_sessions
+        # Set once the store is nearly full, to trigger an early expiry sweep
+        self.cleanup_needed = asyncio.Event()
         self._thread_to_session: Dict[int, str] = {}
-        self._lock = Lock()
+        # Creation sequence, stamped on each session as its seq
+        self._seq = count()
+        # chat_id -> ids of sessions without a pending reply; dicts are used
+        # as sets. A session re-enters its bucket at the end after a reply
+        # is cleared, so bucket order is not creation order
+        self._waiting_by_chat: Dict[int, Dict[str, None]] = {}
+
+    @property
+    def max_sessions(self) -> int:
+        """Maximum number of sessions kept before evicting the oldest."""
+        return self._max_sessions
+
+    @max_sessions.setter
+    def max_sessions(self, value: int) -> None:
+        if value < 1:
+            raise ValueError(f"max_sessions must be at least 1, got {value}")
+        self._max_sessions = value
+
+    def _index_waiting(self, session: SessionData) -> None:
+        """Add session to the waiting index of its chat."""
+        self._waiting_by_chat.setdefault(session.chat_id, {})[session.session_id] = None
+
+    def _unindex_waiting(self, session: SessionData) -> None:
+        """Remove session from the waiting index of its chat."""
+        waiting = self._waiting_by_chat.get(session.chat_id)
+        if waiting is not None:
+            waiting.pop(session.session_id, None)
+            if not waiting:
+                del self._waiting_by_chat[session.chat_id]
+
+    def _set_chat_id(self, session: SessionData, chat_id: int) -> None:
+        """Change session's chat_id, keeping the waiting index in sync."""
+        if session.chat_id == chat_id:
+            return
+        waiting = session.pending_reply is None
+        if waiting:
+            self._unindex_waiting(session)
+        session.chat_id = chat_id
+        if waiting:
+            self._index_waiting(session)
 
     def create_session(
         self,
@@ -22,25 +81,38 @@ class SessionStore:
         cwd: str,
     ) -> SessionData:
         """Create or update a session."""
-        with self._lock:
-            if session_id in self._sessions:
-                # Update existing session
-                session = self._sessions[session_id]
-                session.updated_at = datetime.now()
-                return session
-
-            session = SessionData(
-                session_id=session_id,
-                chat_id=chat_id,
-                cwd=cwd,
-            )
-            self._sessions[session_id] = session
+        if session_id in self._sessions:
+            # Update existing session; a new notification starts a new delivery
+            session = self._sessions[session_id]
+            session.updated_at = self._now()
+            if session.delivery_error is not None:
+                session.delivery_error = None
+                if session.pending_reply is None:
+                    session.reply_event.clear()
             return session
 
+        # Evict the oldest sessions to stay within capacity
+        while len(self._sessions) >= self.max_sessions:
+            self._remove_session(next(iter(self._sessions)))
+
+        now = self._now()
+        session = SessionData(
+            session_id=session_id,
+            chat_id=chat_id,
+            cwd=cwd,
+            seq=next(self._seq),
+            created_at=now,
+            updated_at=now,
+        )
+        self._sessions[session_id] = session
+        self._index_waiting(session)
+        if len(self._sessions) >= self.max_sessions * self.CLEANUP_HIGH_WATER:
+            self.cleanup_needed.set()
+        return session
+
     def get_session(self, session_id: str) -> Optional[SessionData]:
         """Get session by ID."""
-        with self._lock:
-            return self._sessions.get(session_id)
+        return self._sessions.get(session_id)
 
     def update_thread_id(
         self,
@@ -50,15 +122,14 @@ class SessionStore:
         chat_id: int = 0,
     ) -> None:
         """Update session with thread info."""
-        with self._lock:
-            session = self._sessions.get(session_id)
-            if session:
-                session.message_id = message_id
-                session.thread_id = thread_id
-                if chat_id:
-                    session.chat_id = chat_id
-                session.updated_at = datetime.now()
-                self._thread_to_session[thread_id] = session_id
+        session = self._sessions.get(session_id)
+        if session:
+            session.message_id = message_id
+            session.thread_id = thread_id
+            if chat_id:
+                self._set_chat_id(session, chat_id)
+            session.updated_at = self._now()
+            self._thread_to_session[thread_id] = session_id
 
     def set_reply(
         self,
@@ -67,44 +138,59 @@ class SessionStore:
         action: ActionType,
     ) -> None:
         """Set pending reply for session."""
-        with self._lock:
-            session = self._sessions.get(session_id)
-            if session:
-                session.pending_reply = reply
-                session.action = action
-                session.updated_at = datetime.now()
+        session = self._sessions.get(session_id)
+        if session:
+            if session.pending_reply is None:
+                self._unindex_waiting(session)
+            session.pending_reply = reply
+            session.action = action
+            session.updated_at = self._now()
+            session.reply_event.set()
 
     def clear_reply(self, session_id: str) -> None:
         """Clear pending reply."""
-        with self._lock:
-            session = self._sessions.get(session_id)
-            if session:
-                session.pending_reply = None
-                session.action = None
-                session.updated_at = datetime.now()
+        session = self._sessions.get(session_id)
+        if session:
+            if session.pending_reply is not None:
+                self._index_waiting(session)
+            session.pending_reply = None
+            session.action = None
+            session.updated_at = self._now()
+            session.reply_event.clear()
+
+    def set_delivery_error(self, session_id: str, error: str) -> None:
+        """Record that the session's notification could not be delivered."""
+        session = self._sessions.get(session_id)
+        if session:
+            session.delivery_error = error
+            session.updated_at = self._now()
+            # Wake long-polling /reply requests so they can report it
+            session.reply_event.set()
 
     def get_session_by_thread(self, thread_id: int) -> Optional[SessionData]:
         """Get session by Telegram thread ID."""
-        with self._lock:
-            session_id = self._thread_to_session.get(thread_id)
-            if session_id:
-                return self._sessions.get(session_id)
-            return None
+        session_id = self._thread_to_session.get(thread_id)
+        if session_id:
+            return self._sessions.get(session_id)
+        return None
 
     def cleanup_expired(self, expiry_seconds: int) -> int:
         """Remove expired sessions. Returns count of removed sessions."""
-        cutoff = datetime.now() - timedelta(seconds=expiry_seconds)
+        cutoff = self._now() - expiry_seconds
+        # Sessions are in creation order, so the expired ones are a prefix
         removed = 0
-        with self._lock:
-            expired_ids = [
-                sid for sid, session in self._sessions.items()
-                if session.created_at < cutoff
-            ]
-            for sid in expired_ids:
-                session = self._sessions.pop(sid, None)
-                if session and session.thread_id:
-                    self._thread_to_session.pop(session.thread_id, None)
-                removed += 1
+        for session in self._sessions.values():
+            if session.created_at >= cutoff:
+                break
+            removed += 1
+        if removed > len(self._sessions) // 2:
+            # Mass expiry: rebuilding from the survivors is cheaper than
+            # removing the expired sessions one by one
+            self._sessions = OrderedDict(islice(self._sessions.items(), removed, None))
+            self._rebuild_indexes()
+        else:
+            for _ in range(removed):
+                self._remove_session(next(iter(self._sessions)))
         return removed
 
     def list_waiting_sessions(self, chat_id: int) -> List[SessionData]:
@@ -112,41 +198,72 @@ class SessionStore:
 
         Includes sessions with matching chat_id OR chat_id=0 (unassigned).
         """
-        with self._lock:
-            return [
-                session for session in self._sessions.values()
-                if (session.chat_id == chat_id or session.chat_id == 0)
-                and session.pending_reply is None
-            ]
+        own = self._waiting_by_chat.get(chat_id, {})
+        unassigned = self._waiting_by_chat.get(0, {}) if chat_id else {}
+        sessions = [self._sessions[sid] for sid in own]
+        sessions.extend(self._sessions[sid] for sid in unassigned)
+        # Oldest first; buckets are usually already in order, which the
+        # sort handles in linear time
+        sessions.sort(key=lambda s: s.seq)
+        return sessions
 
     def update_chat_id(self, session_id: str, chat_id: int) -> None:
         """Update session's chat_id."""
-        with self._lock:
-            session = self._sessions.get(session_id)
-            if session and session.chat_id == 0:
-                session.chat_id = chat_id
-                session.updated_at = datetime.now()
+        session = self._sessions.get(session_id)
+        if session and session.chat_id == 0:
+            self._set_chat_id(session, chat_id)
+            session.updated_at = self._now()
 
     def add_related_message(self, session_id: str, message_id: int) -> None:
         """Add a message ID to the session's related messages list."""
-        with self._lock:
-            session = self._sessions.get(session_id)
-            if session and message_id not in session.related_message_ids:
-                session.related_message_ids.append(message_id)
-                session.updated_at = datetime.now()
+        self.add_related_messages(session_id, (message_id,))
+
+    def add_related_messages(self, session_id: str, message_ids: Iterable[int]) -> None:
+        """Add several message IDs to the session's related messages list."""
+        session = self._sessions.get(session_id)
+        if session:
+            related = session.related_message_ids
+            for message_id in message_ids:
+                if message_id not in related:
+                    related.append(message_id)
+            session.updated_at = self._now()
 
     def get_related_messages(self, session_id: str) -> list[int]:
         """Get all related message IDs for a session."""
-        with self._lock:
-            session = self._sessions.get(session_id)
-            if session:
-                return list(session.related_message_ids)
-            return []
+        session = self._sessions.get(session_id)
+        if session:
+            return list(session.related_message_ids)
+        return []
+
+    def clear(self) -> None:
+        """Remove all sessions."""
+        self._sessions.clear()
+        self._thread_to_session.clear()
+        self._waiting_by_chat.clear()
+        self.cleanup_needed.clear()
 
     def delete_session(self, session_id: str) -> bool:
         """Delete a session."""
-        with self._lock:
-            session = self._sessions.pop(session_id, None)
-            if session and session.thread_id:
+        return self._remove_session(session_id) is not None
+
+    def _rebuild_indexes(self) -> None:
+        """Rebuild the thread and waiting indexes from the stored sessions."""
+        self._thread_to_session = {
+            session.thread_id: sid
+            for sid, session in self._sessions.items()
+            if session.thread_id
+        }
+        self._waiting_by_chat = {}
+        for session in self._sessions.values():
+            if session.pending_reply is None:
+                self._index_waiting(session)
+
+    def _remove_session(self, session_id: str) -> Optional[SessionData]:
+        """Remove a session and its index entries."""
+        session = self._sessions.pop(session_id, None)
+        if session:
+            if session.thread_id:
                 self._thread_to_session.pop(session.thread_id, None)
-            return session is not None
+            if session.pending_reply is None:
+                self._unindex_waiting(session)
+        return session
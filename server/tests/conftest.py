@@ -1,9 +1,105 @@
 # server/tests/conftest.py
 import pytest
 from unittest.mock import AsyncMock, MagicMock
+from telegram import CallbackQuery, Chat, Message, Update
+
+from claude_notify.bot import TelegramNotifyBot
+from claude_notify.store import SessionStore
+
+# Tests slower than this are recorded in the pytest cache under
+# SLOW_TESTS_KEY; read them back with `pytest --cache-show`
+SLOW_TEST_SECONDS = 0.5
+SLOW_TESTS_KEY = "claude_notify/slow_tests"
+
+_slow_tests = {}
+
+
+def pytest_runtest_logreport(report):
+    if report.when == "call" and report.duration > SLOW_TEST_SECONDS:
+        _slow_tests[report.nodeid] = round(report.duration, 3)
+
+
+def pytest_sessionfinish(session):
+    cache = getattr(session.config, "cache", None)
+    if cache is not None:
+        cache.set(SLOW_TESTS_KEY, _slow_tests)
+
+
+@pytest.fixture(scope="session")
+def store():
+    """Shared store; modules using it clear it before each test."""
+    return SessionStore()
+
+
+@pytest.fixture(scope="session")
+def bot(store):
+    """Shared bot; it builds no Telegram Application until start()."""
+    return TelegramNotifyBot(
+        token="test_token",
+        allowed_chat_ids=[12345],
+        store=store,
+    )
+
 
 @pytest.fixture
 def mock_settings(monkeypatch):
     monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "test_token")
     monkeypatch.setenv("ALLOWED_CHAT_IDS", "12345")
     monkeypatch.setenv("API_KEY", "test_api_key")
+
+
+@pytest.fixture(scope="session")
+def _reply_text_mock():
+    return AsyncMock()
+
+
+@pytest.fixture
+def reply_text_mock(_reply_text_mock):
+    """A reply_text AsyncMock shared across tests, reset for each one."""
+    _reply_text_mock.reset_mock(return_value=True, side_effect=True)
+    return _reply_text_mock
+
+
+@pytest.fixture(scope="session")
+def update_factory():
+    """Build a mock message Update; tests mutate it, so each call is new."""
+    def _make(
+        chat_id=12345,
+        text="test reply",
+        reply_to=None,
+        message_id=500,
+        reply_text=None,
+    ):
+        update = MagicMock(spec=Update)
+        update.message = MagicMock(spec=Message)
+        update.message.text = text
+        update.message.message_id = message_id
+        # spec'd mocks don't know coroutine methods, so set them explicitly
+        if reply_text is None:
+            reply_text = AsyncMock()
+        reply_text.return_value = MagicMock(spec=Message, message_id=message_id + 1)
+        update.message.reply_text = reply_text
+        update.message.reply_to_message = reply_to
+        update.effective_chat = MagicMock(spec=Chat)
+        update.effective_chat.id = chat_id
+        return update
+    return _make
+
+
+@pytest.fixture(scope="session")
+def callback_update_factory():
+    """Build a mock callback-query Update."""
+    def _make(data="action:done", chat_id=12345, message_id=777):
+        update = MagicMock(spec=Update)
+        update.callback_query = MagicMock(spec=CallbackQuery)
+        update.callback_query.answer = AsyncMock()
+        update.callback_query.data = data
+        update.callback_query.edit_message_text = AsyncMock()
+        update.callback_query.message = MagicMock(spec=Message)
+        update.callback_query.message.chat_id = chat_id
+        update.callback_query.message.message_id = message_id
+        update.callback_query.message.text = "Original message"
+        update.callback_query.message.reply_text = AsyncMock()
+        update.callback_query.message.delete = AsyncMock()
+        return update
+    return _make
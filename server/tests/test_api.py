@@ -1,9 +1,13 @@
 # server/tests/test_api.py
+import asyncio
+import time
+
+import httpx
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, MagicMock, patch
 
-from claude_notify.api import create_app
+from claude_notify.api import check_authorization, create_app
 from claude_notify.store import SessionStore
 from claude_notify.models import ActionType
 
@@ -16,15 +20,28 @@ def store():
 @pytest.fixture
 def mock_bot():
     bot = AsyncMock()
-    bot.send_notification = AsyncMock(return_value=(100, 200))
+    bot.primary_chat_id = 12345
+    bot.send_notification = AsyncMock(return_value=(100, 200, 12345))
     bot.send_ack = AsyncMock()
     return bot
 
 
 @pytest.fixture
 def client(store, mock_bot, mock_settings):
-    app = create_app(store=store, bot=mock_bot, api_key="test_api_key")
-    return TestClient(app)
+    app = create_app(
+        store=store, bot=mock_bot, api_key="test_api_key", reply_timeout=0.05
+    )
+    # Keep one event loop alive so background deliveries can finish
+    with TestClient(app) as client:
+        yield client
+
+
+def wait_until(predicate, timeout=1.0):
+    """Poll until predicate is true; background tasks run on the client loop."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
 
 
 def test_health(client):
@@ -44,11 +61,106 @@ def test_notify_success(client, store, mock_bot):
         },
         headers={"Authorization": "Bearer test_api_key"},
     )
-    assert response.status_code == 200
+    assert response.status_code == 202
     data = response.json()
     assert data["ok"] is True
-    assert data["message_id"] == 100
-    assert data["thread_id"] == 200
+    assert data["message_id"] is None
+    assert data["thread_id"] is None
+
+    # Delivery happens in the background and records thread info
+    wait_until(lambda: store.get_session("abc123").thread_id == 200)
+    session = store.get_session("abc123")
+    assert session.message_id == 100
+    assert session.chat_id == 12345
+    mock_bot.send_notification.assert_awaited_once()
+
+
+def test_notify_reuses_existing_thread(client, store, mock_bot):
+    store.create_session("abc123", 12345, "/tmp")
+    store.update_thread_id("abc123", message_id=100, thread_id=200)
+    response = client.post(
+        "/notify",
+        json={
+            "session_id": "abc123",
+            "status": "idle",
+            "summary": "Waiting",
+            "cwd": "/tmp",
+        },
+        headers={"Authorization": "Bearer test_api_key"},
+    )
+    assert response.status_code == 202
+    assert response.json()["thread_id"] == 200
+
+    wait_until(lambda: mock_bot.send_notification.await_count == 1)
+    kwargs = mock_bot.send_notification.await_args.kwargs
+    assert kwargs["existing_thread_id"] == 200
+
+
+def test_notify_delivery_failure_is_logged(client, store, mock_bot):
+    mock_bot.send_notification.side_effect = RuntimeError("Bot not initialized")
+    response = client.post(
+        "/notify",
+        json={
+            "session_id": "abc123",
+            "status": "completed",
+            "summary": "Task done",
+            "cwd": "/tmp",
+        },
+        headers={"Authorization": "Bearer test_api_key"},
+    )
+    assert response.status_code == 202
+    assert response.json()["ok"] is True
+
+    wait_until(lambda: mock_bot.send_notification.await_count == 1)
+    session = store.get_session("abc123")
+    assert session.thread_id is None
+    # The session is still attributed to the bot's chat
+    assert session.chat_id == 12345
+    assert store.list_waiting_sessions(12345) == [session]
+
+
+def test_reply_reports_delivery_failure(client, store, mock_bot):
+    mock_bot.send_notification.side_effect = RuntimeError("Chat not found")
+    client.post(
+        "/notify",
+        json={
+            "session_id": "abc123",
+            "status": "completed",
+            "summary": "Task done",
+            "cwd": "/tmp",
+        },
+        headers={"Authorization": "Bearer test_api_key"},
+    )
+    wait_until(lambda: store.get_session("abc123").delivery_error is not None)
+
+    response = client.get(
+        "/reply/abc123",
+        headers={"Authorization": "Bearer test_api_key"},
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        "has_reply": False,
+        "reply": None,
+        "action": None,
+        "error": "Chat not found",
+    }
+
+
+def test_notify_internal_error_is_not_accepted(client, store):
+    with patch.object(store, "create_session", side_effect=RuntimeError("boom")):
+        response = client.post(
+            "/notify",
+            json={
+                "session_id": "abc123",
+                "status": "completed",
+                "summary": "Task done",
+                "cwd": "/tmp",
+            },
+            headers={"Authorization": "Bearer test_api_key"},
+        )
+    assert response.status_code == 500
+    assert response.json()["ok"] is False
+    assert response.json()["error"] == "boom"
 
 
 def test_notify_unauthorized(client):
@@ -78,6 +190,35 @@ def test_notify_no_auth(client):
     assert response.status_code == 401
 
 
+def test_notify_invalid_auth_format(client):
+    response = client.get(
+        "/reply/abc123",
+        headers={"Authorization": "Token test_api_key"},
+    )
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Invalid authorization format"}
+
+
+def test_auth_scheme_is_case_insensitive(client, store):
+    store.create_session("abc123", 12345, "/tmp")
+    response = client.get(
+        "/reply/abc123",
+        headers={"Authorization": "bearer test_api_key"},
+    )
+    assert response.status_code == 200
+
+
+def test_cors_preflight_skips_auth(client):
+    response = client.options(
+        "/notify",
+        headers={
+            "Origin": "http://example.com",
+            "Access-Control-Request-Method": "POST",
+        },
+    )
+    assert response.status_code == 200
+
+
 def test_reply_no_reply(client, store, mock_settings):
     store.create_session("abc123", 12345, "/tmp")
     response = client.get(
@@ -103,6 +244,31 @@ def test_reply_with_reply(client, store, mock_settings):
     assert data["action"] == "continue"
 
 
+async def test_reply_long_poll_wakes_on_reply(store, mock_bot):
+    app = create_app(
+        store=store, bot=mock_bot, api_key="test_api_key", reply_timeout=5.0
+    )
+    store.create_session("abc123", 12345, "/tmp")
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+        poll = asyncio.create_task(
+            ac.get(
+                "/reply/abc123",
+                headers={"Authorization": "Bearer test_api_key"},
+            )
+        )
+        await asyncio.sleep(0.05)
+        assert not poll.done()
+
+        store.set_reply("abc123", "请继续", ActionType.CONTINUE)
+        response = await asyncio.wait_for(poll, timeout=1.0)
+
+    data = response.json()
+    assert data["has_reply"] is True
+    assert data["reply"] == "请继续"
+
+
 def test_reply_not_found(client, mock_settings):
     response = client.get(
         "/reply/nonexistent",
@@ -123,6 +289,20 @@ def test_ack_success(client, store, mock_bot, mock_settings):
     # Verify reply was cleared
     session = store.get_session("abc123")
     assert session.pending_reply is None
+    wait_until(lambda: mock_bot.send_ack.await_count == 1)
+    mock_bot.send_ack.assert_awaited_once_with(12345, None)
+
+
+def test_ack_does_not_fail_when_send_ack_fails(client, store, mock_bot):
+    mock_bot.send_ack.side_effect = RuntimeError("Bot not initialized")
+    store.create_session("abc123", 12345, "/tmp")
+    response = client.post(
+        "/ack/abc123",
+        headers={"Authorization": "Bearer test_api_key"},
+    )
+    assert response.status_code == 200
+    assert response.json()["ok"] is True
+    wait_until(lambda: mock_bot.send_ack.await_count == 1)
 
 
 def test_ack_not_found(client, mock_settings):
@@ -131,3 +311,14 @@ def test_ack_not_found(client, mock_settings):
         headers={"Authorization": "Bearer test_api_key"},
     )
     assert response.status_code == 404
+
+
+def test_check_authorization_is_cached():
+    check_authorization.cache_clear()
+    assert check_authorization(b"Bearer key", "key") is None
+    assert check_authorization(b"Bearer key", "key") is None
+    assert check_authorization(b"Bearer key", "rotated") == "Invalid API key"
+
+    info = check_authorization.cache_info()
+    assert info.hits == 1
+    assert info.misses == 2
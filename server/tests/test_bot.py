@@ -1,99 +1,113 @@
 # server/tests/test_bot.py
+import asyncio
+import time
+
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter
 from claude_notify.bot import TelegramNotifyBot
 from claude_notify.store import SessionStore
 from claude_notify.models import ActionType, StatusType
 
 
-@pytest.fixture
-def store():
-    return SessionStore()
-
-
-@pytest.fixture
-def bot(store):
-    return TelegramNotifyBot(
-        token="test_token",
-        allowed_chat_ids=[12345],
-        store=store,
-    )
+@pytest.fixture(autouse=True)
+def _reset(store, bot):
+    """Give each test an empty store and a bot without a Telegram app."""
+    store.clear()
+    bot.app = None
+    yield
 
 
 def test_bot_init(bot):
-    assert bot.allowed_chat_ids == [12345]
+    assert bot.allowed_chat_ids == frozenset({12345})
+    assert bot.primary_chat_id == 12345
 
 
-def test_format_message_completed(bot):
+def test_bot_primary_chat_is_first_configured(store):
+    bot = TelegramNotifyBot(
+        token="test_token",
+        allowed_chat_ids=[222, 111],
+        store=store,
+    )
+    assert bot.primary_chat_id == 222
+    assert bot.is_allowed_chat(111) is True
+
+
+@pytest.mark.parametrize(
+    "status,expected",
+    [
+        (StatusType.COMPLETED, "✅ 任务完成"),
+        (StatusType.PERMISSION, "🔐 需要权限"),
+        (StatusType.IDLE, "⏳ 等待输入"),
+    ],
+)
+def test_format_message(bot, status, expected):
     msg = bot.format_message(
         session_id="abc123def456",
-        status=StatusType.COMPLETED,
+        status=status,
         summary="Task completed successfully",
         cwd="/home/user/project",
     )
-    assert "✅ 任务完成" in msg
+    assert expected in msg
     assert "#abc1" in msg
     assert "Task completed successfully" in msg
     assert "user/project" in msg  # 简化后只显示最后两级目录
 
 
-def test_format_message_permission(bot):
-    msg = bot.format_message(
-        session_id="abc123",
-        status=StatusType.PERMISSION,
-        summary="Need permission",
-        cwd="/tmp",
-    )
-    assert "🔐 需要权限" in msg
-
+def test_format_message_caches_prefix_on_session(bot, store):
+    session = store.create_session("abc123def456", 12345, "/home/user/project")
 
-def test_format_message_idle(bot):
-    msg = bot.format_message(
-        session_id="abc123",
-        status=StatusType.IDLE,
-        summary="Waiting",
-        cwd="/tmp",
+    first = bot.format_message(
+        session_id="abc123def456",
+        status=StatusType.COMPLETED,
+        summary="First",
+        cwd="/home/user/project",
+    )
+    second = bot.format_message(
+        session_id="abc123def456",
+        status=StatusType.COMPLETED,
+        summary="Second",
+        cwd="/home/user/project",
     )
-    assert "⏳ 等待输入" in msg
-
-
-def test_parse_action_done(bot):
-    action, reply = bot.parse_user_input("/done")
-    assert action == ActionType.DONE
-    assert reply == "/done"
-
-
-def test_parse_action_cancel(bot):
-    action, reply = bot.parse_user_input("/cancel")
-    assert action == ActionType.CANCEL
-    assert reply == "/cancel"
-
-
-def test_parse_action_cancel_no(bot):
-    """Test 'no' is treated as cancel (for permission denial)."""
-    action, reply = bot.parse_user_input("no")
-    assert action == ActionType.CANCEL
-    assert reply == "no"
-
-
-def test_parse_action_cancel_reject(bot):
-    """Test '拒绝' is treated as cancel."""
-    action, reply = bot.parse_user_input("拒绝")
-    assert action == ActionType.CANCEL
-    assert reply == "拒绝"
-
-
-def test_parse_action_continue(bot):
-    action, reply = bot.parse_user_input("请添加测试")
-    assert action == ActionType.CONTINUE
-    assert reply == "请添加测试"
-
 
-def test_parse_action_continue_yes(bot):
-    """Test 'yes' is treated as continue (for permission approval)."""
-    action, reply = bot.parse_user_input("yes")
-    assert action == ActionType.CONTINUE
-    assert reply == "yes"
+    assert first == "✅ 任务完成 #abc1\n📁 user/project\n\nFirst"
+    assert second == "✅ 任务完成 #abc1\n📁 user/project\n\nSecond"
+    assert len(session.prefix_cache) == 1
+
+
+def test_get_keyboard_default_is_cached(bot):
+    keyboard = bot.get_keyboard()
+    assert keyboard is bot.get_keyboard(None)
+    callbacks = [b.callback_data for b in keyboard.inline_keyboard[0]]
+    assert callbacks == ["action:continue", "action:done"]
+
+
+def test_get_keyboard_custom_buttons_cached(bot):
+    keyboard = bot.get_keyboard(["Yes", "No"])
+    assert keyboard is bot.get_keyboard(["Yes", "No"])
+    assert keyboard is not bot.get_keyboard(["No", "Yes"])
+    callbacks = [b.callback_data for b in keyboard.inline_keyboard[0]]
+    assert callbacks == ["btn:Yes", "btn:No"]
+
+
+@pytest.mark.parametrize(
+    "text,action,reply",
+    [
+        ("/done", ActionType.DONE, "/done"),
+        (" DONE ", ActionType.DONE, "DONE"),
+        ("/cancel", ActionType.CANCEL, "/cancel"),
+        # 'no' / '拒绝' deny a permission request
+        ("no", ActionType.CANCEL, "no"),
+        ("拒绝", ActionType.CANCEL, "拒绝"),
+        # 'yes' approves a permission request
+        ("yes", ActionType.CONTINUE, "yes"),
+        ("请添加测试", ActionType.CONTINUE, "请添加测试"),
+        ("no, use the other approach", ActionType.CONTINUE, "no, use the other approach"),
+    ],
+)
+def test_parse_action(bot, text, action, reply):
+    assert bot.parse_user_input(text) == (action, reply)
 
 
 def test_is_allowed_chat(bot):
@@ -108,23 +122,15 @@ class TestSessionLookup:
     """Tests for session lookup in handle_message and handle_callback."""
 
     @pytest.fixture
-    def mock_update(self):
+    def mock_update(self, update_factory, reply_text_mock):
         """Create a mock Update object."""
-        update = MagicMock()
-        update.message = MagicMock()
-        update.message.text = "test reply"
-        update.message.reply_text = AsyncMock()
-        update.effective_chat = MagicMock()
-        update.effective_chat.id = 12345
-        update.message.reply_to_message = None
-        return update
+        return update_factory(reply_text=reply_text_mock)
 
     @pytest.fixture
     def mock_context(self):
         """Create a mock context."""
         return MagicMock()
 
-    @pytest.mark.asyncio
     async def test_handle_message_finds_session_with_chat_id_zero(
         self, bot, store, mock_update, mock_context
     ):
@@ -142,10 +148,14 @@ class TestSessionLookup:
         # Should find the session and set reply
         assert session.pending_reply == "test reply"
         assert session.action == ActionType.CONTINUE
+        # Both the user's message and the confirmation are tracked
+        assert list(session.related_message_ids) == [
+            mock_update.message.message_id,
+            mock_update.message.reply_text.return_value.message_id,
+        ]
         # chat_id should be updated
         assert session.chat_id == 12345
 
-    @pytest.mark.asyncio
     async def test_handle_message_finds_session_by_thread_id(
         self, bot, store, mock_update, mock_context
     ):
@@ -164,7 +174,7 @@ class TestSessionLookup:
         )
 
         # User replies to the notification message
-        mock_update.message.reply_to_message = MagicMock()
+        mock_update.message.reply_to_message = MagicMock(spec=Message)
         mock_update.message.reply_to_message.message_id = 999
 
         await bot.handle_message(mock_update, mock_context)
@@ -173,7 +183,6 @@ class TestSessionLookup:
         assert session.pending_reply == "test reply"
         assert session.action == ActionType.CONTINUE
 
-    @pytest.mark.asyncio
     async def test_handle_message_updates_chat_id_when_found_by_thread(
         self, bot, store, mock_update, mock_context
     ):
@@ -191,7 +200,7 @@ class TestSessionLookup:
         )
 
         # User replies to the notification message
-        mock_update.message.reply_to_message = MagicMock()
+        mock_update.message.reply_to_message = MagicMock(spec=Message)
         mock_update.message.reply_to_message.message_id = 888
 
         await bot.handle_message(mock_update, mock_context)
@@ -200,7 +209,6 @@ class TestSessionLookup:
         assert session.chat_id == 12345
         assert session.pending_reply == "test reply"
 
-    @pytest.mark.asyncio
     async def test_handle_message_no_session_found(
         self, bot, store, mock_update, mock_context
     ):
@@ -213,7 +221,6 @@ class TestSessionLookup:
             "⚠️ 没有找到等待中的任务。"
         )
 
-    @pytest.mark.asyncio
     async def test_handle_message_unauthorized_chat(
         self, bot, store, mock_update, mock_context
     ):
@@ -232,30 +239,41 @@ class TestSessionLookup:
         assert session.pending_reply is None
 
 
+class TestStatusCommand:
+    """Tests for the /status command."""
+
+    @pytest.fixture
+    def mock_update(self, update_factory, reply_text_mock):
+        return update_factory(text="/status", reply_text=reply_text_mock)
+
+    async def test_handle_status_lists_waiting_sessions(self, bot, store, mock_update):
+        store.create_session("abc123", 12345, "/tmp/a")
+        store.create_session("def456", 0, "/tmp/b")
+
+        await bot.handle_status(mock_update, MagicMock())
+
+        mock_update.message.reply_text.assert_called_with(
+            "📋 等待中的任务:\n\n• #abc1 - /tmp/a\n• #def4 - /tmp/b"
+        )
+
+    async def test_handle_status_no_sessions(self, bot, mock_update):
+        await bot.handle_status(mock_update, MagicMock())
+
+        mock_update.message.reply_text.assert_called_with("✅ 没有等待中的任务")
+
+
 class TestCallbackHandler:
     """Tests for handle_callback function."""
 
     @pytest.fixture
-    def mock_callback_update(self):
+    def mock_callback_update(self, callback_update_factory):
         """Create a mock Update with callback_query."""
-        update = MagicMock()
-        update.callback_query = MagicMock()
-        update.callback_query.answer = AsyncMock()
-        update.callback_query.message = MagicMock()
-        update.callback_query.message.chat_id = 12345
-        update.callback_query.message.message_id = 777
-        update.callback_query.message.text = "Original message"
-        update.callback_query.message.reply_text = AsyncMock()
-        update.callback_query.message.delete = AsyncMock()
-        update.callback_query.edit_message_text = AsyncMock()
-        update.callback_query.data = "action:done"
-        return update
+        return callback_update_factory()
 
     @pytest.fixture
     def mock_context(self):
         return MagicMock()
 
-    @pytest.mark.asyncio
     async def test_handle_callback_finds_session_by_message_id(
         self, bot, store, mock_callback_update, mock_context
     ):
@@ -279,7 +297,6 @@ class TestCallbackHandler:
         assert session.pending_reply == "/done"
         assert session.action == ActionType.DONE
 
-    @pytest.mark.asyncio
     async def test_handle_callback_fallback_to_waiting_session(
         self, bot, store, mock_callback_update, mock_context
     ):
@@ -300,7 +317,34 @@ class TestCallbackHandler:
         assert session.action == ActionType.DONE
         assert session.chat_id == 12345
 
-    @pytest.mark.asyncio
+    async def test_handle_callback_done_deletes_related_messages(
+        self, bot, store, mock_callback_update, mock_context
+    ):
+        """Done should delete the notification and all tracked messages."""
+        bot.app = AsyncMock()
+        store.create_session(
+            session_id="callback-test-done",
+            chat_id=12345,
+            cwd="/test",
+        )
+        store.update_thread_id(
+            session_id="callback-test-done",
+            message_id=777,
+            thread_id=777,
+            chat_id=12345,
+        )
+        store.add_related_message("callback-test-done", 778)
+        store.add_related_message("callback-test-done", 779)
+
+        await bot.handle_callback(mock_callback_update, mock_context)
+
+        deleted = {
+            call.kwargs["message_id"]
+            for call in bot.app.bot.delete_message.await_args_list
+        }
+        assert deleted == {777, 778, 779}
+        assert store.get_session("callback-test-done") is None
+
     async def test_handle_callback_continue_action(
         self, bot, store, mock_callback_update, mock_context
     ):
@@ -326,7 +370,6 @@ class TestCallbackHandler:
             "💬 请输入要继续执行的指令："
         )
 
-    @pytest.mark.asyncio
     async def test_handle_callback_custom_button(
         self, bot, store, mock_callback_update, mock_context
     ):
@@ -350,7 +393,53 @@ class TestCallbackHandler:
         assert session.pending_reply == "Yes, proceed"
         assert session.action == ActionType.CONTINUE
 
-    @pytest.mark.asyncio
+    async def test_handle_callback_done_button_label(
+        self, bot, store, mock_callback_update, mock_context
+    ):
+        """The '结束' button label should behave like action:done."""
+        store.create_session(
+            session_id="callback-test-6",
+            chat_id=12345,
+            cwd="/test",
+        )
+        store.update_thread_id(
+            session_id="callback-test-6",
+            message_id=777,
+            thread_id=777,
+            chat_id=12345,
+        )
+
+        mock_callback_update.callback_query.data = "btn:结束"
+
+        await bot.handle_callback(mock_callback_update, mock_context)
+
+        assert store.get_session("callback-test-6") is None
+
+    async def test_handle_callback_detail(
+        self, bot, store, mock_callback_update, mock_context
+    ):
+        """Detail action should reply with session info and track it."""
+        session = store.create_session(
+            session_id="callback-test-7",
+            chat_id=12345,
+            cwd="/test",
+        )
+        store.update_thread_id(
+            session_id="callback-test-7",
+            message_id=777,
+            thread_id=777,
+            chat_id=12345,
+        )
+
+        mock_callback_update.callback_query.data = "action:detail"
+
+        await bot.handle_callback(mock_callback_update, mock_context)
+
+        text = mock_callback_update.callback_query.message.reply_text.call_args.args[0]
+        assert "callback-test-7" in text
+        assert len(session.related_message_ids) == 1
+        assert session.pending_reply is None
+
     async def test_handle_callback_no_session_expired(
         self, bot, store, mock_callback_update, mock_context
     ):
@@ -362,7 +451,6 @@ class TestCallbackHandler:
             "Original message\n\n⚠️ Session 已过期"
         )
 
-    @pytest.mark.asyncio
     async def test_handle_callback_unauthorized_chat(
         self, bot, store, mock_callback_update, mock_context
     ):
@@ -384,34 +472,29 @@ class TestCallbackHandler:
 class TestStoreListWaitingSessions:
     """Tests for list_waiting_sessions including chat_id=0 sessions."""
 
-    def test_list_waiting_sessions_includes_chat_id_zero(self, store):
-        """Sessions with chat_id=0 should be included in results."""
-        # Create session with chat_id=0
-        session1 = store.create_session(
-            session_id="session-1",
-            chat_id=0,
-            cwd="/test1",
-        )
-        # Create session with matching chat_id
-        session2 = store.create_session(
-            session_id="session-2",
-            chat_id=12345,
-            cwd="/test2",
-        )
-        # Create session with different chat_id
-        session3 = store.create_session(
-            session_id="session-3",
-            chat_id=99999,
-            cwd="/test3",
-        )
-
-        waiting = store.list_waiting_sessions(12345)
-
-        # Should include session1 (chat_id=0) and session2 (chat_id=12345)
-        session_ids = [s.session_id for s in waiting]
-        assert "session-1" in session_ids
-        assert "session-2" in session_ids
-        assert "session-3" not in session_ids
+    @pytest.fixture(scope="module")
+    def populated_store(self):
+        """Read-only store: one unassigned session and one per chat."""
+        store = SessionStore()
+        store.create_session("session-1", 0, "/test1")
+        store.create_session("session-2", 12345, "/test2")
+        store.create_session("session-3", 99999, "/test3")
+        return store
+
+    @pytest.mark.parametrize(
+        "chat_id,expected",
+        [
+            # Sessions with chat_id=0 are included for every chat
+            (12345, ["session-1", "session-2"]),
+            (99999, ["session-1", "session-3"]),
+            (0, ["session-1"]),
+        ],
+    )
+    def test_list_waiting_sessions_includes_chat_id_zero(
+        self, populated_store, chat_id, expected
+    ):
+        waiting = populated_store.list_waiting_sessions(chat_id)
+        assert [s.session_id for s in waiting] == expected
 
     def test_list_waiting_sessions_excludes_replied(self, store):
         """Sessions with pending_reply should be excluded."""
@@ -458,3 +541,77 @@ class TestStoreListWaitingSessions:
 
         # Should not change because original chat_id was not 0
         assert session.chat_id == 11111
+
+
+class TestOutboundQueue:
+    """Tests for the rate-limited outbound send queue."""
+
+    @pytest.fixture
+    async def running_bot(self, store):
+        """Bot with a mocked Telegram API and a running sender task.
+
+        A fresh instance, so queue and rate-limit state never leak into
+        the shared bot.
+        """
+        bot = TelegramNotifyBot(
+            token="test_token",
+            allowed_chat_ids=[12345],
+            store=store,
+        )
+        bot.app = AsyncMock()
+        bot.app.bot.send_message.return_value = MagicMock(message_id=42)
+        bot._sender_task = asyncio.create_task(bot._sender_loop())
+        yield bot
+        await bot.stop()
+
+    async def test_send_notification_goes_through_queue(self, running_bot):
+        result = await running_bot.send_notification(
+            session_id="abc123",
+            status=StatusType.COMPLETED,
+            summary="Done",
+            cwd="/tmp",
+        )
+
+        assert result == (42, 42, 12345)
+        kwargs = running_bot.app.bot.send_message.call_args.kwargs
+        assert kwargs["chat_id"] == 12345
+        assert "Done" in kwargs["text"]
+
+    async def test_retry_after_is_retried(self, running_bot):
+        running_bot.app.bot.send_message.side_effect = [
+            RetryAfter(0),
+            MagicMock(message_id=43),
+        ]
+
+        result = await running_bot.send_notification(
+            session_id="abc123",
+            status=StatusType.COMPLETED,
+            summary="Done",
+            cwd="/tmp",
+            existing_thread_id=7,
+        )
+
+        assert result == (43, 7, 12345)
+        assert running_bot.app.bot.send_message.await_count == 2
+
+    async def test_send_error_is_propagated(self, running_bot):
+        running_bot.app.bot.send_message.side_effect = BadRequest("Chat not found")
+
+        with pytest.raises(BadRequest):
+            await running_bot.send_ack(12345, 7)
+
+    async def test_per_chat_limit_delays_send(self, running_bot, monkeypatch):
+        monkeypatch.setattr(running_bot, "CHAT_RATE_LIMIT", 1)
+        monkeypatch.setattr(running_bot, "CHAT_RATE_WINDOW", 0.05)
+
+        start = time.monotonic()
+        await running_bot.send_ack(12345, 7)
+        await running_bot.send_ack(12345, 7)
+
+        assert time.monotonic() - start >= 0.05
+
+    async def test_send_without_start_raises(self, bot):
+        bot.app = MagicMock()
+        with pytest.raises(RuntimeError):
+            await bot.send_ack(12345, 7)
+
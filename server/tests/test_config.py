@@ -1,32 +1,62 @@
 # server/tests/test_config.py
-import os
 import pytest
+from pydantic import ValidationError
+
+from claude_notify.config import Settings
+
+# Optional settings cleared so their defaults apply
+_OPTIONAL_ENV = (
+    "HOST",
+    "PORT",
+    "SESSION_EXPIRY",
+    "MAX_SESSIONS",
+    "CLEANUP_INTERVAL",
+    "REPLY_TIMEOUT",
+)
+
+
+@pytest.fixture(
+    scope="module",
+    params=[("123,456", [123, 456]), ("123", [123])],
+    ids=["two-chats", "one-chat"],
+)
+def settings_case(request):
+    """Settings built once per ALLOWED_CHAT_IDS value, with the expected ids."""
+    chat_ids, expected_ids = request.param
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("TELEGRAM_BOT_TOKEN", "test_token")
+        mp.setenv("ALLOWED_CHAT_IDS", chat_ids)
+        mp.setenv("API_KEY", "test_key")
+        for name in _OPTIONAL_ENV:
+            mp.delenv(name, raising=False)
+        settings = Settings(_env_file=None)  # Ignore .env file
+    return settings, expected_ids
+
+
+def test_config_from_env(settings_case):
+    settings, expected_ids = settings_case
 
+    assert settings.telegram_bot_token == "test_token"
+    assert settings.allowed_chat_ids == expected_ids
+    assert settings.api_key == "test_key"
 
-def test_config_from_env(monkeypatch):
-    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "test_token")
-    monkeypatch.setenv("ALLOWED_CHAT_IDS", "123,456")
-    monkeypatch.setenv("API_KEY", "test_key")
 
-    # Re-import to pick up env vars
-    from claude_notify.config import Settings
-    settings = Settings()
+def test_config_defaults(settings_case):
+    settings, _ = settings_case
 
-    assert settings.telegram_bot_token == "test_token"
-    assert settings.allowed_chat_ids == [123, 456]
-    assert settings.api_key == "test_key"
+    assert settings.host == "0.0.0.0"
+    assert settings.port == 8000
+    assert settings.session_expiry == 86400
+    assert settings.max_sessions == 10000
+    assert settings.cleanup_interval == 60
+    assert settings.reply_timeout == 25.0
 
 
-def test_config_defaults(monkeypatch):
+def test_config_rejects_non_positive_max_sessions(monkeypatch):
     monkeypatch.setenv("TELEGRAM_BOT_TOKEN", "test_token")
     monkeypatch.setenv("ALLOWED_CHAT_IDS", "123")
     monkeypatch.setenv("API_KEY", "test_key")
-    # Clear PORT env var to test default value
-    monkeypatch.delenv("PORT", raising=False)
-
-    from claude_notify.config import Settings
-    settings = Settings(_env_file=None)  # Ignore .env file for this test
+    monkeypatch.setenv("MAX_SESSIONS", "0")
 
-    assert settings.host == "0.0.0.0"
-    assert settings.port == 8000
-    assert settings.session_expiry == 86400
+    with pytest.raises(ValidationError):
+        Settings(_env_file=None)
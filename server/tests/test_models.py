@@ -10,44 +10,43 @@ from claude_notify.models import (
 )
 
 
-def test_notify_request_valid():
-    req = NotifyRequest(
-        session_id="abc123",
-        status=StatusType.COMPLETED,
-        summary="Task completed",
-        cwd="/home/user/project",
-    )
-    assert req.session_id == "abc123"
-    assert req.status == StatusType.COMPLETED
-
-
-def test_notify_request_with_buttons():
-    req = NotifyRequest(
-        session_id="abc123",
-        status=StatusType.COMPLETED,
-        summary="Task completed",
-        cwd="/tmp",
-        buttons=["继续", "结束"],
-    )
-    assert req.buttons == ["继续", "结束"]
-
+_NOTIFY_BASE = {
+    "session_id": "abc123",
+    "status": StatusType.COMPLETED,
+    "summary": "Task completed",
+    "cwd": "/home/user/project",
+}
 
-def test_reply_response_no_reply():
-    resp = ReplyResponse(has_reply=False)
-    assert resp.has_reply is False
-    assert resp.reply is None
-    assert resp.action is None
 
-
-def test_reply_response_with_reply():
-    resp = ReplyResponse(
-        has_reply=True,
-        reply="请添加测试",
-        action=ActionType.CONTINUE,
-    )
-    assert resp.has_reply is True
-    assert resp.reply == "请添加测试"
-    assert resp.action == ActionType.CONTINUE
+@pytest.mark.parametrize(
+    "model,kwargs,expected",
+    [
+        (
+            NotifyRequest,
+            _NOTIFY_BASE,
+            {"session_id": "abc123", "status": StatusType.COMPLETED, "buttons": None},
+        ),
+        (
+            NotifyRequest,
+            {**_NOTIFY_BASE, "buttons": ["继续", "结束"]},
+            {"buttons": ["继续", "结束"]},
+        ),
+        (
+            ReplyResponse,
+            {"has_reply": False},
+            {"has_reply": False, "reply": None, "action": None},
+        ),
+        (
+            ReplyResponse,
+            {"has_reply": True, "reply": "请添加测试", "action": ActionType.CONTINUE},
+            {"has_reply": True, "reply": "请添加测试", "action": ActionType.CONTINUE},
+        ),
+    ],
+)
+def test_wire_models(model, kwargs, expected):
+    obj = model(**kwargs)
+    for field, value in expected.items():
+        assert getattr(obj, field) == value
 
 
 def test_session_data_short_id():
@@ -57,3 +56,10 @@ def test_session_data_short_id():
         cwd="/tmp",
     )
     assert session.short_id == "abc1"
+
+
+def test_session_data_is_slotted():
+    session = SessionData(session_id="abc123", chat_id=12345, cwd="/tmp")
+    assert not hasattr(session, "__dict__")
+    assert list(session.related_message_ids) == []
+    assert session.created_at == pytest.approx(session.updated_at, abs=1)
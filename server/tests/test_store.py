@@ -1,13 +1,32 @@
 # server/tests/test_store.py
 import pytest
-from datetime import datetime, timedelta
 from claude_notify.store import SessionStore
 from claude_notify.models import SessionData, ActionType
 
 
+class FakeClock:
+    """Controllable clock for SessionStore(now=...)."""
+
+    def __init__(self, now: float = 1_700_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
 @pytest.fixture
-def store():
-    return SessionStore()
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture(autouse=True)
+def _reset(store):
+    """Give each test an empty store."""
+    store.clear()
+    yield
 
 
 def test_create_session(store):
@@ -70,12 +89,10 @@ def test_get_session_by_thread_not_found(store):
     assert session is None
 
 
-def test_cleanup_expired(store):
-    # Create an expired session
+def test_cleanup_expired(clock):
+    store = SessionStore(now=clock.time)
     store.create_session("old123", 12345, "/tmp")
-    store._sessions["old123"].created_at = datetime.now() - timedelta(hours=25)
-
-    # Create a fresh session
+    clock.advance(25 * 3600)
     store.create_session("new456", 12345, "/tmp")
 
     # Cleanup with 24 hour expiry
@@ -85,6 +102,60 @@ def test_cleanup_expired(store):
     assert store.get_session("new456") is not None
 
 
+def test_cleanup_expired_stops_at_first_fresh_session(clock):
+    store = SessionStore(now=clock.time)
+    store.create_session("old1", 12345, "/tmp")
+    store.create_session("old2", 12345, "/tmp")
+    clock.advance(25 * 3600)
+    store.create_session("new3", 12345, "/tmp")
+
+    assert store.cleanup_expired(86400) == 2
+    assert store.get_session("new3") is not None
+
+
+def test_cleanup_expired_mass_expiry_keeps_indexes(clock):
+    store = SessionStore(now=clock.time)
+    for i in range(4):
+        store.create_session(f"old{i}", 12345, "/tmp")
+        store.update_thread_id(f"old{i}", message_id=i, thread_id=100 + i)
+    clock.advance(25 * 3600)
+    store.create_session("new", 12345, "/tmp")
+    store.update_thread_id("new", message_id=9, thread_id=200)
+    store.create_session("replied", 12345, "/tmp")
+    store.set_reply("replied", "ok", ActionType.CONTINUE)
+
+    assert store.cleanup_expired(86400) == 4
+    assert list(store._sessions) == ["new", "replied"]
+    assert store.get_session_by_thread(100) is None
+    assert store.get_session_by_thread(200).session_id == "new"
+    assert [s.session_id for s in store.list_waiting_sessions(12345)] == ["new"]
+
+
+def test_create_session_evicts_oldest_at_capacity():
+    store = SessionStore(max_sessions=2)
+    store.create_session("first", 12345, "/tmp")
+    store.update_thread_id("first", message_id=100, thread_id=100)
+    store.create_session("second", 12345, "/tmp")
+    store.create_session("third", 12345, "/tmp")
+
+    assert store.get_session("first") is None
+    assert store.get_session_by_thread(100) is None
+    assert [s.session_id for s in store.list_waiting_sessions(12345)] == [
+        "second",
+        "third",
+    ]
+
+
+def test_create_session_signals_cleanup_near_capacity():
+    store = SessionStore(max_sessions=10)
+    for i in range(8):
+        store.create_session(f"s{i}", 12345, "/tmp")
+    assert not store.cleanup_needed.is_set()
+
+    store.create_session("s8", 12345, "/tmp")
+    assert store.cleanup_needed.is_set()
+
+
 def test_list_waiting_sessions(store):
     store.create_session("abc123", 12345, "/tmp")
     store.create_session("def456", 12345, "/tmp")
@@ -93,3 +164,104 @@ def test_list_waiting_sessions(store):
     waiting = store.list_waiting_sessions(12345)
     assert len(waiting) == 1
     assert waiting[0].session_id == "abc123"
+
+
+def test_list_waiting_sessions_after_clear_reply(store):
+    store.create_session("abc123", 12345, "/tmp")
+    store.set_reply("abc123", "done", ActionType.DONE)
+    assert store.list_waiting_sessions(12345) == []
+
+    store.clear_reply("abc123")
+    waiting = store.list_waiting_sessions(12345)
+    assert [s.session_id for s in waiting] == ["abc123"]
+
+
+def test_list_waiting_sessions_follows_chat_id_change(store):
+    store.create_session("abc123", 0, "/tmp")
+    store.update_thread_id("abc123", message_id=100, thread_id=100, chat_id=12345)
+
+    assert [s.session_id for s in store.list_waiting_sessions(12345)] == ["abc123"]
+    assert store.list_waiting_sessions(99999) == []
+
+
+def test_list_waiting_sessions_keeps_creation_order(store):
+    store.create_session("first", 0, "/tmp")
+    store.create_session("second", 12345, "/tmp")
+    store.create_session("third", 0, "/tmp")
+
+    waiting = store.list_waiting_sessions(12345)
+    assert [s.session_id for s in waiting] == ["first", "second", "third"]
+
+
+def test_list_waiting_sessions_order_survives_reply_cycle(clock):
+    # A frozen clock gives both sessions the same created_at
+    store = SessionStore(now=clock.time)
+    store.create_session("A", 12345, "/tmp")
+    store.create_session("B", 12345, "/tmp")
+
+    store.set_reply("A", "ok", ActionType.CONTINUE)
+    store.clear_reply("A")
+
+    waiting = store.list_waiting_sessions(12345)
+    assert [s.session_id for s in waiting] == ["A", "B"]
+
+
+def test_delivery_error_wakes_pollers_until_next_notify(store):
+    session = store.create_session("abc123", 12345, "/tmp")
+    store.set_delivery_error("abc123", "Chat not found")
+    assert session.delivery_error == "Chat not found"
+    assert session.reply_event.is_set()
+
+    # Notifying again retries delivery, so the old failure no longer applies
+    store.create_session("abc123", 12345, "/tmp")
+    assert session.delivery_error is None
+    assert not session.reply_event.is_set()
+
+
+@pytest.mark.parametrize("max_sessions", [0, -1])
+def test_max_sessions_must_be_positive(max_sessions):
+    with pytest.raises(ValueError):
+        SessionStore(max_sessions=max_sessions)
+    store = SessionStore()
+    with pytest.raises(ValueError):
+        store.max_sessions = max_sessions
+
+
+def test_delete_session_clears_indexes(store):
+    store.create_session("abc123", 12345, "/tmp")
+    store.update_thread_id("abc123", message_id=100, thread_id=200)
+
+    assert store.delete_session("abc123") is True
+    assert store.get_session_by_thread(200) is None
+    assert store.list_waiting_sessions(12345) == []
+
+
+def test_reply_event_follows_reply_state(store):
+    event = store.create_session("abc123", 12345, "/tmp").reply_event
+    assert not event.is_set()
+
+    store.set_reply("abc123", "请继续", ActionType.CONTINUE)
+    assert event.is_set()
+
+    store.clear_reply("abc123")
+    assert not event.is_set()
+
+
+def test_clear_removes_sessions_and_indexes(store):
+    store.create_session("abc123", 12345, "/tmp")
+    store.update_thread_id("abc123", message_id=100, thread_id=200)
+    store.cleanup_needed.set()
+
+    store.clear()
+
+    assert store.get_session("abc123") is None
+    assert store.get_session_by_thread(200) is None
+    assert store.list_waiting_sessions(12345) == []
+    assert not store.cleanup_needed.is_set()
+
+
+def test_add_related_messages(store):
+    store.create_session("abc123", 12345, "/tmp")
+    store.add_related_message("abc123", 100)
+    store.add_related_messages("abc123", [100, 101, 102])
+    assert store.get_related_messages("abc123") == [100, 101, 102]